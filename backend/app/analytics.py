@@ -0,0 +1,80 @@
+"""
+Order analytics rollups.
+
+order_daily_rollups holds one row per (supplier, day, shop, product) with the
+number of orders, quantity and amount. Orders are added when created and
+removed when cancelled, so the table always reflects non-cancelled orders.
+Multi-line orders are split by product, so they count once per product.
+
+Built once from existing orders by app/migrations.py, so cancellations never
+subtract an order the table did not count. Rebuild from scratch:
+python -m app.analytics
+"""
+import asyncio
+from typing import List
+
+from sqlalchemy import select, func, cast, Date, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.database import AsyncSessionLocal
+from app.models import Order, OrderItem, OrderStatus, Contract, OrderDailyRollup
+
+ROLLUP_COLUMNS = ["supplier_id", "day", "shop_id", "product_id", "order_count", "quantity", "total_amount"]
+
+
+def _rollup_select(sign: int = 1):
+    """Orders grouped into rollup rows, multiplied by sign (+1 add, -1 remove)"""
+    day = cast(Order.created_at, Date)
+    # Multi-line orders are split by item, single-line orders use their contract's product
+    product_id = func.coalesce(OrderItem.product_id, Contract.product_id)
+    return (
+        select(
+            Order.supplier_id,
+            day,
+            Order.shop_id,
+            product_id,
+            func.count(Order.id.distinct()) * sign,
+            func.sum(func.coalesce(OrderItem.quantity, Order.quantity)) * sign,
+            func.sum(func.coalesce(OrderItem.total_amount, Order.total_amount)) * sign,
+        )
+        .join(Contract, Contract.id == Order.contract_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .group_by(Order.supplier_id, day, Order.shop_id, product_id)
+    )
+
+
+def _upsert(rows):
+    stmt = pg_insert(OrderDailyRollup).from_select(ROLLUP_COLUMNS, rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["supplier_id", "day", "shop_id", "product_id"],
+        set_={
+            "order_count": OrderDailyRollup.order_count + stmt.excluded.order_count,
+            "quantity": OrderDailyRollup.quantity + stmt.excluded.quantity,
+            "total_amount": OrderDailyRollup.total_amount + stmt.excluded.total_amount,
+        }
+    )
+
+
+async def record_orders(db, order_ids: List[int], sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) orders from the rollup in the caller's transaction"""
+    if not order_ids:
+        return
+    await db.execute(_upsert(_rollup_select(sign).where(Order.id.in_(order_ids))))
+
+
+async def backfill(db):
+    """Rebuild the whole rollup table from orders"""
+    await db.execute(delete(OrderDailyRollup))
+    await db.execute(_upsert(_rollup_select().where(Order.status != OrderStatus.CANCELLED)))
+
+
+async def main():
+    async with AsyncSessionLocal() as db:
+        await backfill(db)
+        await db.commit()
+        result = await db.execute(select(func.count()).select_from(OrderDailyRollup))
+        print(f"✅ Rebuilt order_daily_rollups: {result.scalar()} rows")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""
+Chat attachment storage.
+
+Uploads arrive as a raw request body and are written to disk chunk by chunk,
+hashing and counting as they go, so a large PDF never sits in worker memory
+and an oversized one is cut off as soon as it passes the limit. Files live in
+ATTACHMENT_DIR, outside the public /uploads mount: they are only served by the
+chat download endpoint after its access check, with HTTP Range support.
+Only raster images are shown inline; anything else (HTML, SVG, ...) is a
+download, sandboxed and never content-sniffed, so an upload cannot run
+script in the app's origin.
+"""
+import hashlib
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import aiofiles
+from fastapi import HTTPException
+
+from app.config import settings
+
+CHUNK_SIZE = 64 * 1024
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Same image types as the public /upload endpoints; not SVG, which can carry script
+INLINE_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+
+@dataclass
+class StoredFile:
+    path: str       # Relative to ATTACHMENT_DIR
+    size: int
+    sha256: str
+
+
+def attachment_root() -> Path:
+    return Path(settings.ATTACHMENT_DIR)
+
+
+async def store_stream(chunks: AsyncIterator[bytes], folder: str) -> StoredFile:
+    """Write chunks to ATTACHMENT_DIR/folder/<uuid>, 413 once more than ATTACHMENT_MAX_BYTES arrive"""
+    directory = attachment_root() / folder
+    directory.mkdir(parents=True, exist_ok=True)
+    name = uuid.uuid4().hex
+    tmp_path = directory / f"{name}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > settings.ATTACHMENT_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File size exceeds {settings.ATTACHMENT_MAX_BYTES // (1024 * 1024)}MB limit"
+                    )
+                digest.update(chunk)
+                await f.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="File rỗng")
+        os.replace(tmp_path, directory / name)
+    finally:
+        # Rejected or interrupted upload
+        if tmp_path.exists():
+            os.remove(tmp_path)
+    return StoredFile(path=f"{folder}/{name}", size=size, sha256=digest.hexdigest())
+
+
+def remove_stored(path: str):
+    full_path = attachment_root() / path
+    if full_path.exists():
+        os.remove(full_path)
+
+
+def download_headers(filename: str, content_type: str) -> Dict[str, str]:
+    disposition = "inline" if content_type.lower() in INLINE_CONTENT_TYPES else "attachment"
+    return {
+        "Content-Disposition": f"{disposition}; filename*=UTF-8''{quote(filename)}",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "sandbox",
+    }
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive of a single "bytes=" range, None to send the whole
+    file (no header, or several ranges), 416 if it cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise HTTPException(status_code=416, detail="Range Not Satisfiable", headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range Not Satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def read_chunks(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    """Bytes start..end (inclusive) of a stored file, CHUNK_SIZE at a time"""
+    remaining = end - start + 1
+    async with aiofiles.open(attachment_root() / path, "rb") as f:
+        await f.seek(start)
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,126 @@
+"""
+Full-text search over chat messages.
+
+Messages are indexed with a GIN expression index on
+to_tsvector('chat_search', message). chat_search is a copy of the 'simple'
+text search configuration (no stemming, which Vietnamese does not need) that
+strips accents with the unaccent dictionary, so "don hang" finds "Đơn hàng".
+The same configuration parses the query and builds the highlighted snippets,
+so highlights land on the original accented words.
+
+setup_chat_search runs at startup with the migrations (app.migrations), under
+their advisory lock, and is idempotent. Where the unaccent
+extension is not available the configuration is plain 'simple' and search is
+accent-sensitive; once the extension is installed the next startup adds it
+and rebuilds the index.
+"""
+import html
+
+from sqlalchemy import text, literal_column, func
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+SEARCH_CONFIG = "chat_search"
+SEARCH_INDEX = "ix_chat_messages_message_fts"
+# Control characters as markers so the message text can be HTML-escaped before they become <mark>
+_START, _STOP = "\x01", "\x02"
+HEADLINE_OPTIONS = f"StartSel={_START}, StopSel={_STOP}, MaxWords=25, MinWords=8, MaxFragments=2"
+
+# Spelled out literally (not a bind parameter) so the planner matches the expression index
+_config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+
+
+async def _reindex(conn: AsyncConnection, index: str):
+    """REINDEX an index; before PostgreSQL 14 a partitioned index is rebuilt one partition at a time"""
+    version = (await conn.execute(text("SELECT current_setting('server_version_num')::int"))).scalar()
+    if version >= 140000:
+        await conn.execute(text(f"REINDEX INDEX {index}"))
+        return
+    result = await conn.execute(text("""
+        WITH RECURSIVE tree AS (
+            SELECT to_regclass(:index) AS relid
+            UNION ALL
+            SELECT i.inhrelid FROM pg_inherits i JOIN tree t ON i.inhparent = t.relid
+        )
+        SELECT t.relid::regclass::text FROM tree t JOIN pg_class c ON c.oid = t.relid
+        WHERE c.relkind = 'i'
+    """), {"index": index})
+    for partition_index in result.scalars().all():
+        await conn.execute(text(f"REINDEX INDEX {partition_index}"))
+
+
+async def setup_chat_search(conn: AsyncConnection):
+    """Create the text search configuration and the GIN index if missing"""
+    await conn.execute(text(f"""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{SEARCH_CONFIG}') THEN
+                CREATE TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} (COPY = simple);
+            END IF;
+        END $$
+    """))
+
+    try:
+        async with conn.begin_nested():
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+    except Exception as e:
+        print(f"⚠️ unaccent extension not available, chat search is accent-sensitive: {e.__class__.__name__}")
+        has_unaccent = False
+    else:
+        has_unaccent = True
+
+    index_exists = (await conn.execute(text("SELECT to_regclass(:name)"), {"name": SEARCH_INDEX})).scalar()
+    if has_unaccent:
+        result = await conn.execute(text(f"""
+            SELECT 1 FROM pg_ts_config_map m
+            JOIN pg_ts_config c ON c.oid = m.mapcfg
+            JOIN pg_ts_dict d ON d.oid = m.mapdict
+            WHERE c.cfgname = '{SEARCH_CONFIG}' AND d.dictname = 'unaccent'
+            LIMIT 1
+        """))
+        if result.scalar() is None:
+            await conn.execute(text(
+                f"ALTER TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} "
+                "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, simple"
+            ))
+            if index_exists:
+                # Existing entries were indexed with accents
+                print("🔎 Rebuilding chat search index with unaccent")
+                await _reindex(conn, SEARCH_INDEX)
+
+    if not index_exists:
+        # On a large existing table, create it CONCURRENTLY by hand before deploying
+        await conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON chat_messages "
+            f"USING gin (to_tsvector('{SEARCH_CONFIG}'::regconfig, message))"
+        ))
+
+
+def search_vector(column):
+    return func.to_tsvector(_config, column)
+
+
+def search_query(q: str):
+    """Parse user input: words are ANDed, "quoted phrases", OR, -excluded"""
+    return func.websearch_to_tsquery(_config, q)
+
+
+def headline(column, query):
+    return func.ts_headline(_config, column, query, HEADLINE_OPTIONS)
+
+
+def snippet_html(snippet: str) -> str:
+    """Escape a ts_headline snippet and wrap the matches in <mark></mark>"""
+    return html.escape(snippet).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def parse_cursor(cursor: str):
+    """Cursor "<rank>:<id>" of the last result of the previous page, None if malformed"""
+    rank, _, message_id = cursor.partition(":")
+    try:
+        return float(rank), int(message_id)
+    except ValueError:
+        return None
+
+
+def format_cursor(rank: float, message_id: int) -> str:
+    # repr() round-trips the float exactly, so ties on rank are resolved by id
+    return f"{rank!r}:{message_id}"
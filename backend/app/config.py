@@ -33,6 +33,37 @@ class Settings(BaseSettings):
     # App
     DEBUG: bool = False
     
+    # Background jobs
+    SCHEDULER_ENABLED: bool = True
+    RFQ_TTL_DAYS: int = 30                  # Open RFQs older than this are closed
+    RFQ_SWEEP_INTERVAL_SECONDS: int = 3600
+    RFQ_SWEEP_BATCH_SIZE: int = 500
+    RECURRING_ORDER_INTERVAL_SECONDS: int = 3600
+    RECURRING_ORDER_BATCH_SIZE: int = 500
+    
+    # Monthly partitions of chat_messages / notifications
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 6 * 3600
+    PARTITION_MONTHS_AHEAD: int = 3
+    # Months kept online; older months are archived to ARCHIVE_DIR and dropped. 0 keeps all
+    CHAT_MESSAGE_RETENTION_MONTHS: int = 0
+    NOTIFICATION_RETENTION_MONTHS: int = 0
+    # Must be durable storage (e.g. a mounted persistent disk), not the instance's ephemeral
+    # disk (Render free plan); nothing is archived while it is empty
+    ARCHIVE_DIR: str = ""
+    
+    # Chat attachments (not under the public /uploads mount, served after an access check)
+    ATTACHMENT_DIR: str = "attachments"
+    ATTACHMENT_MAX_BYTES: int = 50 * 1024 * 1024  # 50MB
+    
+    # Forward bus events (chat, notifications, ...) between workers over Postgres LISTEN/NOTIFY
+    EVENT_BUS_ENABLED: bool = True
+    
+    # Idempotency-Key header
+    IDEMPOTENCY_TTL_HOURS: int = 24
+    IDEMPOTENCY_WAIT_SECONDS: int = 30      # How long a duplicate waits for the first request
+    IDEMPOTENCY_LEASE_SECONDS: int = 30     # Renewed while a request runs; a lapsed lease (crashed worker) can be taken over
+    IDEMPOTENCY_MAX_BODY_BYTES: int = 10 * 1024 * 1024  # Bodies are buffered to be hashed; larger ones get 413
+    
     class Config:
         env_file = ".env"
         extra = "allow"
@@ -0,0 +1,223 @@
+"""
+Event bus.
+
+Routers publish small payloads (ids only) on named channels after their
+transaction commits; long-poll endpoints and socket handlers subscribe to
+channels and re-query the database when woken.
+
+Events are delivered to local subscribers straight away. Once start() has
+been called (main.lifespan), they are also forwarded to the other workers
+through Postgres NOTIFY on a single pg channel, multiplexing all bus channels,
+and events from other workers arrive over a dedicated LISTEN connection.
+NOTIFY payloads are capped at 8000 bytes, so lists of ids are split across
+several notifications. If the connection drops, events may have been missed:
+after reconnecting every subscriber receives {"resync": True} and must re-read
+from its own cursor (after_id etc.), and the other workers are told to do the same.
+"""
+import asyncio
+import json
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, Iterator, Optional, Set
+
+import asyncpg
+
+PG_CHANNEL = "b2b_events"
+MAX_PAYLOAD_BYTES = 7900            # Postgres limit is 8000 bytes
+OUTGOING_QUEUE_SIZE = 10_000
+KEEPALIVE_SECONDS = 30
+RECONNECT_MAX_DELAY = 30
+RESYNC = {"resync": True}
+
+
+class Subscription:
+    """Queue of events received on one or more channels"""
+
+    def __init__(self, channels, maxsize: int = 100):
+        self.channels = set(channels)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def _deliver(self, channel: str, payload: dict):
+        try:
+            self.queue.put_nowait((channel, payload))
+        except asyncio.QueueFull:
+            # Slow consumer: remember it so it can resync from the database
+            self.overflowed = True
+
+    async def get(self, timeout: Optional[float] = None):
+        """Wait for the next event, returns None on timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def _split(payload: dict) -> Iterator[dict]:
+    """Split a payload into parts that fit in one NOTIFY by halving its longest list"""
+    if len(json.dumps(payload, separators=(",", ":"))) <= MAX_PAYLOAD_BYTES:
+        yield payload
+        return
+    lists = [key for key, value in payload.items() if isinstance(value, list) and len(value) > 1]
+    if not lists:
+        # Cannot be split: listeners re-read from the database instead
+        yield RESYNC
+        return
+    key = max(lists, key=lambda k: len(payload[k]))
+    half = len(payload[key]) // 2
+    yield from _split({**payload, key: payload[key][:half]})
+    yield from _split({**payload, key: payload[key][half:]})
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.origin = uuid.uuid4().hex
+        self._outgoing: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dropped = False
+
+    def publish(self, channel: str, payload: Optional[dict] = None):
+        """Deliver payload to every subscriber of channel, in this and (if started) other workers"""
+        payload = payload or {}
+        self._deliver_local(channel, payload)
+        if self._outgoing is None:
+            return
+        for part in _split(payload):
+            try:
+                self._outgoing.put_nowait(self._envelope(channel, part))
+            except asyncio.QueueFull:
+                self._dropped = True
+
+    @asynccontextmanager
+    async def subscribe(self, *channels: str, maxsize: int = 100):
+        sub = Subscription(channels, maxsize=maxsize)
+        for channel in sub.channels:
+            self._subscribers.setdefault(channel, set()).add(sub)
+        try:
+            yield sub
+        finally:
+            for channel in sub.channels:
+                subs = self._subscribers.get(channel)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subscribers[channel]
+
+    # ==================== LOCAL DELIVERY ====================
+
+    def _deliver_local(self, channel: str, payload: dict):
+        for sub in list(self._subscribers.get(channel, ())):
+            sub._deliver(channel, payload)
+
+    def _resync_local(self):
+        """Tell every local subscriber that events may have been missed"""
+        subs = {sub for channel_subs in self._subscribers.values() for sub in channel_subs}
+        for sub in subs:
+            sub._deliver(next(iter(sub.channels)), RESYNC)
+
+    # ==================== POSTGRES BRIDGE ====================
+
+    def _envelope(self, channel: str, payload: dict) -> str:
+        return json.dumps({"o": self.origin, "c": channel, "p": payload}, separators=(",", ":"))
+
+    def _on_notify(self, connection, pid, pg_channel, data):
+        try:
+            envelope = json.loads(data)
+        except ValueError:
+            return
+        if envelope.get("o") == self.origin:
+            # Already delivered locally by publish()
+            return
+        if envelope.get("c") == "*":
+            self._resync_local()
+        else:
+            self._deliver_local(envelope["c"], envelope.get("p") or {})
+
+    async def start(self, dsn: str):
+        """Start forwarding events between workers over LISTEN/NOTIFY"""
+        if self._task is not None:
+            return
+        self._outgoing = asyncio.Queue(maxsize=OUTGOING_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run(dsn))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._outgoing = None
+
+    async def _next_outgoing(self, lost: asyncio.Event) -> Optional[str]:
+        """Next envelope to send, or None when idle for KEEPALIVE_SECONDS or the connection dropped"""
+        getter = asyncio.ensure_future(self._outgoing.get())
+        waiter = asyncio.ensure_future(lost.wait())
+        try:
+            await asyncio.wait({getter, waiter}, timeout=KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            if not getter.done():
+                getter.cancel()
+        return getter.result() if getter.done() and not getter.cancelled() else None
+
+    async def _run(self, dsn: str):
+        delay = 1
+        connected_before = False
+        pending: Optional[str] = None
+        while True:
+            try:
+                conn = await asyncpg.connect(dsn)
+            except (OSError, asyncpg.PostgresError) as e:
+                print(f"⚠️ Event bus cannot connect, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            delay = 1
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            try:
+                await conn.add_listener(PG_CHANNEL, self._on_notify)
+                if connected_before:
+                    # Events of other workers sent while we were away are lost, and ours may be too
+                    self._resync_local()
+                    self._dropped = True
+                connected_before = True
+                print("📡 Event bus connected")
+
+                while True:
+                    if self._dropped:
+                        self._dropped = False
+                        await conn.execute("SELECT pg_notify($1, $2)", PG_CHANNEL, self._envelope("*", RESYNC))
+                    if pending is None:
+                        pending = await self._next_outgoing(lost)
+                        if pending is None:
+                            if lost.is_set():
+                                raise ConnectionError("connection closed")
+                            # Idle: make sure the LISTEN connection is still alive
+                            await conn.execute("SELECT 1")
+                            continue
+                    await conn.execute("SELECT pg_notify($1, $2)", PG_CHANNEL, pending)
+                    pending = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Event bus connection lost: {e}")
+            finally:
+                if not conn.is_closed():
+                    conn.terminate()
+
+
+bus = EventBus()
+
+
+def negotiation_channel(rfq_id: int) -> str:
+    return f"negotiations:{rfq_id}"
+
+
+def notification_channel(user_id: int) -> str:
+    return f"notifications:{user_id}"
+
+
+def chat_channel(user_id: int) -> str:
+    return f"chat:{user_id}"
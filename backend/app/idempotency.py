@@ -0,0 +1,338 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+A client that retries POST /shops/rfq, POST /orders, POST /suppliers/me/quotes,
+POST /chat/rooms/{id}/messages (or any other POST/PUT/PATCH/DELETE) with the
+same Idempotency-Key header gets the stored response of the first attempt
+instead of executing the handler again. A duplicate that arrives while the
+first attempt is still running waits for it to finish.
+
+The attempt in flight holds a lease on the key (locked_until), renewed while
+the handler runs. If its worker crashes or is redeployed the lease lapses and
+the next retry takes the key over instead of waiting for the TTL. locked_at
+identifies the owner: a request whose key was taken over stores nothing.
+
+Only authenticated requests are covered; anonymous ones (login, register) run
+as usual, since they would otherwise share a single key namespace.
+
+The body is buffered to hash and replay it, so it is capped at
+IDEMPOTENCY_MAX_BODY_BYTES (413 beyond). Routes that stream their body to disk
+(STREAMED_PATHS) bypass the middleware, so a key never pulls a large upload
+into memory.
+"""
+import asyncio
+import hashlib
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+from app.auth import decode_token
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import IdempotencyKey
+
+HEADER = "idempotency-key"
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.5
+
+# Bodies streamed by the handler itself (chat attachments), never buffered here
+STREAMED_PATHS = (
+    re.compile(r"^/chat/rooms/\d+/attachments/?$"),
+)
+
+# Waiters for requests in flight in this worker, keyed by (user_id, key)
+_in_flight: Dict[tuple, asyncio.Event] = {}
+
+
+class KeyReusedError(Exception):
+    pass
+
+
+def _user_id(headers: Headers) -> Optional[int]:
+    auth = headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        token_data = decode_token(auth[7:])
+        if token_data and token_data.user_id:
+            return token_data.user_id
+    return None
+
+
+def _lease_until(now: datetime) -> datetime:
+    return now + timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+
+
+def _lease_expired(record: IdempotencyKey) -> bool:
+    return record.locked_until is None or record.locked_until < datetime.now(timezone.utc)
+
+
+def _request_hash(scope, body: bytes) -> str:
+    digest = hashlib.sha256()
+    digest.update(scope["method"].encode())
+    digest.update(scope["path"].encode())
+    digest.update(scope.get("query_string", b""))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+async def _claim(user_id: int, key: str, request_hash: str, locked_at: datetime) -> Optional[IdempotencyKey]:
+    """
+    Insert an in-flight record for the key, or take over one whose lease lapsed.
+    Returns None when this request owns the key (as locked_at), otherwise the existing record.
+    """
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as db:
+        # Expired keys can be reused straight away
+        await db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.expires_at < now
+            )
+        )
+        result = await db.execute(
+            pg_insert(IdempotencyKey)
+            .values(
+                user_id=user_id,
+                key=key,
+                request_hash=request_hash,
+                locked_at=locked_at,
+                locked_until=_lease_until(now),
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "key"])
+            .returning(IdempotencyKey.id)
+        )
+        claimed = result.scalar_one_or_none()
+        if claimed is None:
+            # The first attempt died without storing a response
+            result = await db.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.request_hash == request_hash,
+                    IdempotencyKey.status_code.is_(None),
+                    or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until < now)
+                )
+                .values(locked_at=locked_at, locked_until=_lease_until(now))
+                .returning(IdempotencyKey.id)
+            )
+            claimed = result.scalar_one_or_none()
+        await db.commit()
+        if claimed is not None:
+            return None
+
+        result = await db.execute(
+            select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        )
+        record = result.scalar_one_or_none()
+
+    if record is None:
+        # Deleted in between (first attempt failed), try again
+        return await _claim(user_id, key, request_hash, locked_at)
+    if record.request_hash != request_hash:
+        raise KeyReusedError()
+    return record
+
+
+async def _wait_for_completion(user_id: int, key: str) -> Optional[IdempotencyKey]:
+    """Wait until the first attempt stores its response, gives up the key or loses its lease"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while loop.time() < deadline:
+        event = _in_flight.get((user_id, key))
+        if event is not None:
+            # Same worker: wake up as soon as it finishes
+            try:
+                await asyncio.wait_for(event.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(POLL_INTERVAL)
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(IdempotencyKey).where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+            )
+            record = result.scalar_one_or_none()
+        if record is None or record.status_code is not None or _lease_expired(record):
+            return record
+    return None
+
+
+async def _renew_lease(user_id: int, key: str, locked_at: datetime):
+    """Keep the lease of a running request alive"""
+    while True:
+        await asyncio.sleep(settings.IDEMPOTENCY_LEASE_SECONDS / 3)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IdempotencyKey)
+                .where(
+                    IdempotencyKey.user_id == user_id,
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.locked_at == locked_at,
+                    IdempotencyKey.status_code.is_(None)
+                )
+                .values(locked_until=_lease_until(datetime.now(timezone.utc)))
+            )
+            await db.commit()
+
+
+async def _store(
+    user_id: int, key: str, locked_at: datetime, status_code: int, content_type: Optional[str], body: bytes
+):
+    # Only while this request still owns the key
+    owned = (
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.key == key,
+        IdempotencyKey.locked_at == locked_at,
+        IdempotencyKey.status_code.is_(None)
+    )
+    async with AsyncSessionLocal() as db:
+        if status_code >= 500:
+            # Server errors are not cached, a retry should run the handler again
+            await db.execute(delete(IdempotencyKey).where(*owned))
+        else:
+            await db.execute(
+                update(IdempotencyKey)
+                .where(*owned)
+                .values(status_code=status_code, content_type=content_type, response_body=body)
+            )
+        await db.commit()
+
+
+def _replay(record: IdempotencyKey) -> Response:
+    return Response(
+        content=record.response_body or b"",
+        status_code=record.status_code,
+        media_type=record.content_type,
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware, only active for mutating requests carrying Idempotency-Key"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        key = headers.get(HEADER)
+        user_id = _user_id(headers) if key else None
+        if user_id is None or any(pattern.match(scope["path"]) for pattern in STREAMED_PATHS):
+            return await self.app(scope, receive, send)
+        if len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)
+            return await response(scope, receive, send)
+
+        declared = headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > settings.IDEMPOTENCY_MAX_BODY_BYTES:
+            return await self._too_large(scope, receive, send)
+
+        # Buffer the request body so it can be hashed and replayed to the app
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > settings.IDEMPOTENCY_MAX_BODY_BYTES:
+                return await self._too_large(scope, receive, send)
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+
+        request_hash = _request_hash(scope, body)
+        locked_at = datetime.now(timezone.utc)
+        try:
+            record = await _claim(user_id, key, request_hash, locked_at)
+            if record is not None and record.status_code is None:
+                record = await _wait_for_completion(user_id, key)
+                if record is None or record.status_code is None:
+                    # Gone or lease lapsed: take the key (None again if someone else just did)
+                    record = await _claim(user_id, key, request_hash, locked_at)
+                    if record is None:
+                        return await self._execute(scope, receive, send, user_id, key, locked_at, body)
+        except KeyReusedError:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used for a different request"},
+                status_code=422
+            )
+            return await response(scope, receive, send)
+
+        if record is not None:
+            if record.status_code is None:
+                response = JSONResponse(
+                    {"detail": "A request with this Idempotency-Key is still in progress"},
+                    status_code=409
+                )
+                return await response(scope, receive, send)
+            return await _replay(record)(scope, receive, send)
+
+        await self._execute(scope, receive, send, user_id, key, locked_at, body)
+
+    async def _too_large(self, scope, receive, send):
+        response = JSONResponse(
+            {"detail": f"Request body exceeds {settings.IDEMPOTENCY_MAX_BODY_BYTES // (1024 * 1024)}MB limit"},
+            status_code=413
+        )
+        return await response(scope, receive, send)
+
+    async def _execute(self, scope, receive, send, user_id: int, key: str, locked_at: datetime, body: bytes):
+        event = asyncio.Event()
+        _in_flight[(user_id, key)] = event
+        renew = asyncio.create_task(_renew_lease(user_id, key, locked_at))
+
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                # Body already delivered, pass through disconnect messages
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status_code = 500
+        content_type = None
+        response_chunks = []
+
+        async def capture_send(message):
+            nonlocal status_code, content_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = Headers(raw=message.get("headers", [])).get("content-type")
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_body, capture_send)
+        finally:
+            renew.cancel()
+            try:
+                await _store(user_id, key, locked_at, status_code, content_type, b"".join(response_chunks))
+            finally:
+                _in_flight.pop((user_id, key), None)
+                event.set()
+
+
+async def purge_expired_keys(conn):
+    """Scheduler job: drop idempotency records past their TTL"""
+    await conn.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.now(timezone.utc))
+    )
+    await conn.commit()
@@ -0,0 +1,87 @@
+"""
+Product stock reservation.
+
+Stock is taken when an order is created and given back when it is cancelled.
+Both are single conditional UPDATEs in the caller's transaction, so concurrent
+orders for the same product can never take more than what is in stock.
+
+Orders that took stock are flagged stock_reserved; only those give it back
+(orders created before reservation existed never took any), and only once.
+"""
+from typing import Dict, List, Set
+
+from fastapi import HTTPException
+from sqlalchemy import select, update, func, values, column, Integer
+
+from app.models import Product, Order, OrderItem, Contract
+
+
+async def reserve_stock(db, product_id: int, quantity: int) -> int:
+    """Take quantity from the product's stock, returns the remaining stock (409 if not enough)"""
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.stock >= quantity)
+        .values(stock=Product.stock - quantity)
+        .returning(Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+    remaining = result.scalar_one_or_none()
+    if remaining is None:
+        raise HTTPException(status_code=409, detail="Không đủ hàng trong kho")
+    return remaining
+
+
+async def reserve_stock_bulk(db, quantities: Dict[int, int]) -> Set[int]:
+    """
+    Take stock for many products in one UPDATE ({product_id: quantity}).
+    Returns the ids of the products that had enough; the others are untouched.
+    """
+    if not quantities:
+        return set()
+    wanted = values(
+        column("product_id", Integer), column("quantity", Integer), name="wanted"
+    ).data(list(quantities.items()))
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == wanted.c.product_id, Product.stock >= wanted.c.quantity)
+        .values(stock=Product.stock - wanted.c.quantity)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    return set(result.scalars().all())
+
+
+async def release_stock(db, order_ids: List[int]):
+    """Give the quantities of the given orders back to their products' stock"""
+    if not order_ids:
+        return
+    result = await db.execute(
+        update(Order)
+        .where(Order.id.in_(order_ids), Order.stock_reserved)
+        .values(stock_reserved=False)
+        .returning(Order.id)
+        .execution_options(synchronize_session=False)
+    )
+    order_ids = result.scalars().all()
+    if not order_ids:
+        return
+    # Multi-line orders give back each item, single-line orders their contract's product
+    product_id = func.coalesce(OrderItem.product_id, Contract.product_id)
+    released = (
+        select(
+            product_id.label("product_id"),
+            func.sum(func.coalesce(OrderItem.quantity, Order.quantity)).label("quantity")
+        )
+        .select_from(Order)
+        .join(Contract, Contract.id == Order.contract_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.id.in_(order_ids))
+        .group_by(product_id)
+        .subquery()
+    )
+    await db.execute(
+        update(Product)
+        .where(Product.id == released.c.product_id)
+        .values(stock=func.coalesce(Product.stock, 0) + released.c.quantity)
+        .execution_options(synchronize_session=False)
+    )
@@ -4,7 +4,14 @@ from contextlib import asynccontextmanager
 
 from app.config import settings
 from app.database import engine, Base
-from app.routers import auth, users, suppliers, shops, products, rfq, quotes, negotiations, contracts, admin, ai, notifications, upload, orders, chat  # <-- Thêm chat
+from app.scheduler import start_jobs, stop_jobs, run_locked, LOCK_PARTITIONS, LOCK_CHAT_ROOMS_UNIQUE, LOCK_MIGRATIONS
+from app.migrations import run_migrations
+from app.partitions import ensure_partitions
+from app.routers.chat import ensure_unique_chat_rooms
+from app.idempotency import IdempotencyMiddleware
+from app.events import bus
+from app.presence import presence
+from app.routers import auth, users, suppliers, shops, products, rfq, quotes, negotiations, contracts, admin, ai, notifications, upload, orders, recurring_orders, chat, analytics  # <-- Thêm chat
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -14,8 +21,21 @@ async def lifespan(app: FastAPI):
     print(f"📋 CORS origins list: {settings.get_cors_origins()}")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    # Columns / indexes create_all does not add to existing tables, and the chat search
+    # configuration; the other workers wait for it
+    await run_locked("migrations", LOCK_MIGRATIONS, run_migrations, wait=True)
+    await run_locked("partitions", LOCK_PARTITIONS, ensure_partitions)
+    # Room creation relies on the constraint (ON CONFLICT), so no worker serves before it exists
+    await run_locked("chat-rooms-unique", LOCK_CHAT_ROOMS_UNIQUE, ensure_unique_chat_rooms, wait=True)
+    if settings.EVENT_BUS_ENABLED:
+        await bus.start(engine.url.set(drivername="postgresql").render_as_string(hide_password=False))
+    await presence.start()
+    jobs = start_jobs()
     yield
     # Shutdown
+    await stop_jobs(jobs)
+    await presence.stop()
+    await bus.stop()
     await engine.dispose()
 
 app = FastAPI(
@@ -31,6 +51,9 @@ app = FastAPI(
 cors_origins = settings.get_cors_origins()
 print(f"🔧 Configuring CORS with origins: {cors_origins}")
 
+# Idempotency-Key replay (added before CORS so replayed responses get CORS headers)
+app.add_middleware(IdempotencyMiddleware)
+
 # CORS - cho phép frontend truy cập
 app.add_middleware(
     CORSMiddleware,
@@ -38,6 +61,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -51,6 +75,8 @@ app.include_router(quotes.router, prefix="/quotes", tags=["Quotes"])
 app.include_router(negotiations.router, prefix="/negotiations", tags=["Negotiations"])
 app.include_router(contracts.router, prefix="/contracts", tags=["Contracts"])
 app.include_router(orders.router, prefix="/orders", tags=["Orders"])
+app.include_router(recurring_orders.router, prefix="/recurring-orders", tags=["Recurring Orders"])
+app.include_router(analytics.router, prefix="/analytics", tags=["Analytics"])
 app.include_router(chat.router, prefix="/chat", tags=["Chat"])  # <-- Thêm dòng này
 app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 app.include_router(ai.router, prefix="/ai", tags=["AI Features"])
@@ -0,0 +1,146 @@
+"""
+Schema changes for existing databases.
+
+Base.metadata.create_all (main.lifespan) only creates missing tables: it never
+adds a column or an index to a table that already exists. Each step below makes
+one such change, either as SQL or as an async function of the connection for
+data fixes. Steps are applied once, in order, and recorded in
+schema_migrations; they are idempotent as well, so on a fresh database (where
+create_all already did the work) they are no-ops.
+
+After the steps, setup_chat_search brings the chat search configuration and
+index up to date. It is not a one-off step: it picks up the unaccent extension
+whenever that becomes available.
+
+main.lifespan applies pending steps at startup, under an advisory lock that the
+other workers wait on. On a large live table, build the indexes without
+blocking writes before deploying:
+
+    python -m app.migrations --concurrently
+
+(a CONCURRENTLY build that fails leaves an invalid index: drop it and re-run).
+"""
+import asyncio
+import sys
+from typing import Awaitable, Callable, List, Set, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.analytics import backfill as backfill_order_rollups
+from app.chat_search import setup_chat_search
+from app.database import engine
+
+_CREATE_INDEX = "CREATE INDEX "
+
+Statement = Union[str, Callable[[AsyncConnection], Awaitable[None]]]
+
+# (name, statements), in the order they are applied. Never rename or reorder applied steps.
+MIGRATIONS: List[Tuple[str, List[Statement]]] = [
+    # Negotiation thread pages and long-poll (after_id / before_id)
+    ("negotiations_rfq_id_id_index", [
+        "CREATE INDEX IF NOT EXISTS ix_negotiations_rfq_id_id ON negotiations (rfq_id, id)",
+    ]),
+    # Expired RFQ sweeper
+    ("rfq_status_created_at_index", [
+        "CREATE INDEX IF NOT EXISTS ix_rfq_status_created_at ON rfq (status, created_at)",
+    ]),
+    # Keyset pagination of a supplier's / shop's orders
+    ("orders_supplier_shop_id_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_orders_supplier_id_id ON orders (supplier_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_shop_id_id ON orders (shop_id, id)",
+    ]),
+    # Order timeline (?since= deltas)
+    ("order_tracking_order_id_created_at_index", [
+        "CREATE INDEX IF NOT EXISTS ix_order_tracking_order_id_created_at ON order_tracking (order_id, created_at)",
+    ]),
+    # Optimistic concurrency on order status (Order.version); existing orders start at 1
+    ("orders_version_column", [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1",
+    ]),
+    # Idempotency-Key leases
+    ("idempotency_keys_lease_columns", [
+        "ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS locked_at timestamptz",
+        "ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS locked_until timestamptz",
+    ]),
+    # Stock reservation flag; existing orders never reserved stock, so they stay false
+    ("orders_stock_reserved_column", [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS stock_reserved boolean NOT NULL DEFAULT false",
+    ]),
+    # Chat read watermarks from the legacy per-message is_read flags (recipient's latest read message)
+    ("chat_room_members_backfill", [
+        """
+        INSERT INTO chat_room_members (chat_room_id, user_id, last_read_message_id)
+        SELECT m.chat_room_id,
+               CASE WHEN m.sender_id = su.user_id THEN sh.user_id ELSE su.user_id END,
+               max(m.id)
+        FROM chat_messages m
+        JOIN chat_rooms r ON r.id = m.chat_room_id
+        JOIN suppliers su ON su.id = r.supplier_id
+        JOIN shops sh ON sh.id = r.shop_id
+        WHERE m.is_read
+        GROUP BY 1, 2
+        ON CONFLICT (chat_room_id, user_id) DO NOTHING
+        """,
+    ]),
+    # Order rollups were only built by hand (python -m app.analytics); cancelling an order
+    # they never counted would subtract it
+    ("order_daily_rollups_backfill", [
+        backfill_order_rollups,
+    ]),
+    # Monthly schedules keep their first run's day of month; existing ones anchor on their next run
+    ("recurring_order_schedules_anchor_day", [
+        "ALTER TABLE recurring_order_schedules ADD COLUMN IF NOT EXISTS anchor_day integer",
+        "UPDATE recurring_order_schedules SET anchor_day = extract(day FROM next_run_date) WHERE anchor_day IS NULL",
+    ]),
+]
+
+
+async def applied_migrations(conn: AsyncConnection) -> Set[str]:
+    await conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name varchar(100) PRIMARY KEY,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """))
+    names = (await conn.execute(text("SELECT name FROM schema_migrations"))).scalars().all()
+    await conn.commit()
+    return set(names)
+
+
+async def run_migrations(conn: AsyncConnection, concurrently: bool = False):
+    """Apply the pending steps, each in its own transaction (concurrently needs an AUTOCOMMIT connection)"""
+    done = await applied_migrations(conn)
+    for name, statements in MIGRATIONS:
+        if name in done:
+            continue
+        print(f"🔄 Migration {name}")
+        for statement in statements:
+            if callable(statement):
+                await statement(conn)
+                continue
+            if concurrently and statement.startswith(_CREATE_INDEX):
+                statement = statement.replace(_CREATE_INDEX, "CREATE INDEX CONCURRENTLY ", 1)
+            await conn.execute(text(statement))
+        await conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+        await conn.commit()
+    if concurrently:
+        # setup_chat_search uses a savepoint, which needs a transaction
+        await conn.execution_options(isolation_level="READ COMMITTED")
+    await setup_chat_search(conn)
+    await conn.commit()
+
+
+async def _main(args: List[str]):
+    concurrently = "--concurrently" in args
+    try:
+        bind = engine.execution_options(isolation_level="AUTOCOMMIT") if concurrently else engine
+        async with bind.connect() as conn:
+            await run_migrations(conn, concurrently=concurrently)
+        print("✅ Migrations done")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Numeric, ForeignKey, DateTime, Date, Enum as SQLEnum, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Numeric, ForeignKey, DateTime, Date, Enum as SQLEnum, Boolean, Index, UniqueConstraint, LargeBinary, Sequence, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -55,11 +55,28 @@ class OrderStatus(str, enum.Enum):
     COMPLETED = "completed"                 # Hoàn thành
     CANCELLED = "cancelled"                 # Đã hủy
 
+# Allowed order status changes, enforced server-side
+ORDER_TRANSITIONS = {
+    OrderStatus.PENDING: {OrderStatus.CONFIRMED, OrderStatus.CANCELLED},
+    OrderStatus.CONFIRMED: {OrderStatus.PAYMENT_PENDING, OrderStatus.PAID, OrderStatus.CANCELLED},
+    OrderStatus.PAYMENT_PENDING: {OrderStatus.PAID, OrderStatus.CANCELLED},
+    OrderStatus.PAID: {OrderStatus.PROCESSING},
+    OrderStatus.PROCESSING: {OrderStatus.SHIPPING},
+    OrderStatus.SHIPPING: {OrderStatus.DELIVERED},
+    OrderStatus.DELIVERED: {OrderStatus.COMPLETED},
+    OrderStatus.COMPLETED: set(),
+    OrderStatus.CANCELLED: set(),
+}
+
 class PaymentMethod(str, enum.Enum):
     BANK_TRANSFER = "bank_transfer"         # Chuyển khoản
     QR_CODE = "qr_code"                     # QR Code
     COD = "cod"                             # Thanh toán khi nhận hàng
 
+class RecurrenceFrequency(str, enum.Enum):
+    WEEKLY = "weekly"                       # Hàng tuần
+    MONTHLY = "monthly"                     # Hàng tháng
+
 # ==================== USERS ====================
 class User(Base):
     __tablename__ = "users"
@@ -146,6 +163,10 @@ class Product(Base):
 # ==================== RFQ ====================
 class RFQ(Base):
     __tablename__ = "rfq"
+    __table_args__ = (
+        # Expiry sweeper: WHERE status IN (...) AND created_at < cutoff
+        Index("ix_rfq_status_created_at", "status", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False)
@@ -182,6 +203,10 @@ class Quote(Base):
 # ==================== NEGOTIATIONS ====================
 class Negotiation(Base):
     __tablename__ = "negotiations"
+    __table_args__ = (
+        # Thread pagination: WHERE rfq_id = ? AND id > / < cursor
+        Index("ix_negotiations_rfq_id_id", "rfq_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     rfq_id = Column(Integer, ForeignKey("rfq.id"), nullable=False)
@@ -218,22 +243,31 @@ class Contract(Base):
 # ==================== NOTIFICATIONS ====================
 class Notification(Base):
     __tablename__ = "notifications"
+    # Monthly partitions on created_at (app/partitions.py)
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     type = Column(SQLEnum(NotificationType), nullable=False)
     title = Column(String(255), nullable=False)
     message = Column(Text)
     link = Column(String(500))  # Link to related page
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     
     # Relationships
     user = relationship("User", back_populates="notifications")
+    
+    # The table key is (id, created_at) because of partitioning; rows are still identified by id
+    __mapper_args__ = {"primary_key": [id]}
 
 # ==================== CHAT ====================
 class ChatRoom(Base):
     __tablename__ = "chat_rooms"
+    __table_args__ = (
+        # One room per supplier/shop pair (get_or_create_chat_room relies on it)
+        UniqueConstraint("supplier_id", "shop_id", name="uq_chat_rooms_supplier_shop"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=False)
@@ -248,24 +282,83 @@ class ChatRoom(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
-    
-    id = Column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        # Latest message per room and messages past a read watermark
+        Index("ix_chat_messages_chat_room_id_id", "chat_room_id", "id"),
+        # Monthly partitions on created_at (app/partitions.py)
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     chat_room_id = Column(Integer, ForeignKey("chat_rooms.id"), nullable=False)
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     message = Column(Text, nullable=False)
-    is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    is_read = Column(Boolean, default=False)  # Legacy flag, read state now comes from ChatRoomMember
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     
     # Relationships
     chat_room = relationship("ChatRoom", back_populates="messages")
     sender = relationship("User")
+    attachments = relationship(
+        "ChatAttachment",
+        primaryjoin="ChatMessage.id == foreign(ChatAttachment.message_id)",
+        order_by="ChatAttachment.id",
+        lazy="selectin",
+        viewonly=True,
+    )
+    
+    __mapper_args__ = {"primary_key": [id]}
+
+# Default partitions, so inserts work before the monthly partitions are created
+for _partitioned in (Notification.__table__, ChatMessage.__table__):
+    event.listen(
+        _partitioned, "after_create",
+        DDL(f"CREATE TABLE IF NOT EXISTS {_partitioned.name}_default PARTITION OF {_partitioned.name} DEFAULT")
+    )
+
+class ChatRoomMember(Base):
+    """Read watermark of one participant: messages with id <= last_read_message_id are read"""
+    __tablename__ = "chat_room_members"
+    
+    chat_room_id = Column(Integer, ForeignKey("chat_rooms.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ChatAttachment(Base):
+    """File sent in a chat room, stored under ATTACHMENT_DIR (app/attachments.py)"""
+    __tablename__ = "chat_attachments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chat_room_id = Column(Integer, ForeignKey("chat_rooms.id"), nullable=False, index=True)
+    # No foreign key: chat_messages is partitioned and its key includes created_at
+    message_id = Column(Integer, nullable=False, index=True)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    storage_path = Column(String(500), nullable=False)  # Relative to ATTACHMENT_DIR
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    @property
+    def url(self) -> str:
+        return f"/chat/attachments/{self.id}"
 
 # ==================== ORDERS ====================
+# Source of the numeric part of Order.order_code; never repeats, needs no locking
+order_code_seq = Sequence("order_code_seq", metadata=Base.metadata)
+
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Keyset pagination of a supplier's / shop's orders, newest first
+        Index("ix_orders_supplier_id_id", "supplier_id", "id"),
+        Index("ix_orders_shop_id_id", "shop_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    order_code = Column(String(50), unique=True, nullable=False)  # Mã đơn hàng: ORD-YYYYMMDD-XXX
+    order_code = Column(String(50), unique=True, nullable=False)  # Mã đơn hàng: ORD-YYYYMMDD-NNNNNN
     contract_id = Column(Integer, ForeignKey("contracts.id"), nullable=False)
     supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=False)
     shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False)
@@ -283,6 +376,10 @@ class Order(Base):
     payment_proof = Column(String(500))  # URL ảnh chứng từ thanh toán
     paid_at = Column(DateTime(timezone=True))
     
+    # Optimistic concurrency: bumped by every status change
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    stock_reserved = Column(Boolean, nullable=False, default=False, server_default="false")  # Stock was taken (released on cancel)
+    
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
@@ -291,9 +388,34 @@ class Order(Base):
     supplier = relationship("Supplier", back_populates="orders")
     shop = relationship("Shop", back_populates="orders")
     tracking_history = relationship("OrderTracking", back_populates="order", order_by="OrderTracking.created_at.desc()")
+    items = relationship("OrderItem", back_populates="order", order_by="OrderItem.id")
+
+class OrderItem(Base):
+    """
+    One line of a multi-line order. For such orders Order.contract_id is the
+    first line's contract, Order.quantity / total_amount are the sums of the
+    lines and Order.unit_price is the average price.
+    """
+    __tablename__ = "order_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    contract_id = Column(Integer, ForeignKey("contracts.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Numeric(12, 2), nullable=False)
+    total_amount = Column(Numeric(12, 2), nullable=False)
+    
+    # Relationships
+    order = relationship("Order", back_populates="items")
+    product = relationship("Product")
 
 class OrderTracking(Base):
     __tablename__ = "order_tracking"
+    __table_args__ = (
+        # Timeline queries: WHERE order_id = ? (a handful of events per order)
+        Index("ix_order_tracking_order_id_created_at", "order_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
@@ -306,6 +428,45 @@ class OrderTracking(Base):
     order = relationship("Order", back_populates="tracking_history")
     user = relationship("User")
 
+class RecurringOrderSchedule(Base):
+    """Replenishment order placed automatically from a contract by app.recurring_orders"""
+    __tablename__ = "recurring_order_schedules"
+    __table_args__ = (
+        # Due-schedule sweep: WHERE is_active AND next_run_date <= today ORDER BY id
+        Index("ix_recurring_order_schedules_due", "is_active", "next_run_date"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contract_id = Column(Integer, ForeignKey("contracts.id"), nullable=False, index=True)
+    shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False)
+    frequency = Column(SQLEnum(RecurrenceFrequency), nullable=False)
+    next_run_date = Column(Date, nullable=False)
+    anchor_day = Column(Integer)  # Day of month of the first run; monthly runs clamp it, never drift from it
+    shipping_address = Column(Text)
+    note = Column(Text)
+    payment_method = Column(SQLEnum(PaymentMethod), default=PaymentMethod.BANK_TRANSFER)
+    is_active = Column(Boolean, nullable=False, default=True, server_default="true")
+    last_run_at = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    contract = relationship("Contract")
+
+# ==================== ANALYTICS ====================
+class OrderDailyRollup(Base):
+    """Per-day order totals, maintained incrementally by app.analytics"""
+    __tablename__ = "order_daily_rollups"
+    
+    # Primary key leads with (supplier_id, day) for supplier time-range queries
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    shop_id = Column(Integer, ForeignKey("shops.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Numeric(14, 2), nullable=False, default=0)
+
 # ==================== SUPPLIER PAYMENT INFO ====================
 class SupplierPaymentInfo(Base):
     __tablename__ = "supplier_payment_info"
@@ -323,3 +484,22 @@ class SupplierPaymentInfo(Base):
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# ==================== IDEMPOTENCY KEYS ====================
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)     # sha256 of method, path and body
+    status_code = Column(Integer)                          # NULL while the first request is in flight
+    locked_at = Column(DateTime(timezone=True))            # Claim time of the request in flight (its owner token)
+    locked_until = Column(DateTime(timezone=True))         # Lease, renewed while the request runs
+    content_type = Column(String(100))
+    response_body = Column(LargeBinary)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
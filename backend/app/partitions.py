@@ -0,0 +1,418 @@
+"""
+Monthly partitions for chat_messages and notifications.
+
+Both tables are range-partitioned on created_at, one partition per month
+(chat_messages_y2026m01, ...), plus a default partition that catches rows no
+monthly partition covers yet, so inserts never fail. The table primary key is
+(id, created_at) as Postgres requires; the models still identify rows by id,
+so queries are unchanged and filters on created_at prune partitions.
+
+maintain_partitions (scheduler job; ensure_partitions also runs at startup)
+creates the coming months' partitions, moving rows out of the default partition if some already
+landed there, and archives old months. Archival is off by default: it needs a
+retention (CHAT_MESSAGE_RETENTION_MONTHS, NOTIFICATION_RETENTION_MONTHS) and an
+ARCHIVE_DIR on durable storage. Each partition older than the table's retention
+is detached and dumped to ARCHIVE_DIR/<table>/<partition>.csv.gz; the dump is
+read back and its row count checked before the partition is dropped, and a
+partition that could not be archived is attached again. A chat_messages month
+takes its chat_attachments rows (chat_attachments/<partition>.csv.gz) and
+files (chat_attachments/<partition>/) along. Nothing else references these
+tables.
+
+    python -m app.partitions migrate          # convert existing plain tables (one transaction)
+    python -m app.partitions maintain         # run the job once
+    python -m app.partitions restore FILE     # re-attach an archived month
+"""
+import asyncio
+import gzip
+import os
+import re
+import shutil
+import sys
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.attachments import attachment_root, remove_stored
+from app.config import settings
+from app.database import engine
+from app.models import ChatAttachment, ChatMessage, Notification
+
+WRITE_BUFFER_BYTES = 1 << 20
+RESTORE_CHUNK_BYTES = 1 << 20
+_PARTITION_NAME = re.compile(r"^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+RESTORED_COMMENT = "restored from archive"
+
+# Their default partitions are created with the tables (app/models.py)
+PARTITIONED_TABLES = (ChatMessage.__table__, Notification.__table__)
+
+
+def _retention_months() -> Dict[str, int]:
+    """Months kept online per table, 0 keeps everything"""
+    return {
+        ChatMessage.__tablename__: settings.CHAT_MESSAGE_RETENTION_MONTHS,
+        Notification.__tablename__: settings.NOTIFICATION_RETENTION_MONTHS,
+    }
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def _bounds(month: date) -> Tuple[str, str]:
+    # Month boundaries in UTC, whatever the session time zone
+    return f"{month.isoformat()} 00:00:00+00", f"{_add_months(month, 1).isoformat()} 00:00:00+00"
+
+
+async def _is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    result = await conn.execute(text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table})
+    return result.scalar() == "p"
+
+
+async def _partitions(conn: AsyncConnection, table: str, attached: bool) -> List[Tuple[str, date]]:
+    """Monthly partitions of table, (name, month), attached ones or detached leftovers"""
+    if attached:
+        result = await conn.execute(text("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:t)
+        """), {"t": table})
+    else:
+        result = await conn.execute(text("""
+            SELECT c.relname FROM pg_class c
+            WHERE c.relkind = 'r' AND NOT c.relispartition AND c.relname LIKE :prefix
+              AND c.relnamespace = 'public'::regnamespace
+        """), {"prefix": f"{table}\\_y%"})
+    months = []
+    for name in result.scalars():
+        match = _PARTITION_NAME.match(name)
+        if match and match["table"] == table:
+            months.append((name, date(int(match["year"]), int(match["month"]), 1)))
+    return sorted(months, key=lambda item: item[1])
+
+
+async def create_partition(conn: AsyncConnection, table: str, month: date) -> bool:
+    """Create the partition of month if missing, returns True if it was created"""
+    name = partition_name(table, month)
+    if (await conn.execute(text("SELECT to_regclass(:n)"), {"n": name})).scalar() is not None:
+        return False
+    low, high = _bounds(month)
+    default = f"{table}_default"
+    in_default = (await conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= '{low}' AND created_at < '{high}')"
+    ))).scalar()
+    if not in_default:
+        await conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{low}') TO ('{high}')"
+        ))
+        return True
+
+    # Rows of this month are already in the default partition: move them, then attach
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {default} WHERE created_at >= '{low}' AND created_at < '{high}' RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """))
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{low}') TO ('{high}')"))
+    print(f"🗂️ Moved {month:%Y-%m} rows of {table} out of the default partition")
+    return True
+
+
+async def ensure_partitions(conn: AsyncConnection, months_ahead: Optional[int] = None):
+    """Create the partitions of the current month and the next months_ahead months"""
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    this_month = date.today().replace(day=1)
+    for table in PARTITIONED_TABLES:
+        if not await _is_partitioned(conn, table.name):
+            print(f"⚠️ {table.name} is not partitioned yet, run: python -m app.partitions migrate")
+            continue
+        for offset in range(months_ahead + 1):
+            if await create_partition(conn, table.name, _add_months(this_month, offset)):
+                print(f"🗂️ Created partition {partition_name(table.name, _add_months(this_month, offset))}")
+        await conn.commit()
+
+
+# ==================== ARCHIVAL ====================
+
+def archive_path(table: str, partition: str) -> Path:
+    return Path(settings.ARCHIVE_DIR) / table / f"{partition}.csv.gz"
+
+
+def _attachment_archive_dir(partition: str) -> Path:
+    return Path(settings.ARCHIVE_DIR) / ChatAttachment.__tablename__ / partition
+
+
+def _attachments_query(partition: str) -> str:
+    return f"SELECT * FROM {ChatAttachment.__tablename__} WHERE message_id IN (SELECT id FROM {partition})"
+
+
+def _check_archive(path: Path):
+    """Read a gzip file through to the end, which checks its CRC and length"""
+    with gzip.open(path, "rb") as archive:
+        while archive.read(RESTORE_CHUNK_BYTES):
+            pass
+
+
+async def _dump(conn: AsyncConnection, path: Path, query: str) -> int:
+    """
+    COPY a query to a gzipped CSV (with header), written to a temp file, read
+    back and renamed. Returns the number of rows.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    raw = (await conn.get_raw_connection()).driver_connection
+    try:
+        with open(tmp_path, "wb") as file, gzip.GzipFile(fileobj=file, mode="wb") as archive:
+            buffer = bytearray()
+
+            async def write(chunk: bytes):
+                buffer.extend(chunk)
+                if len(buffer) >= WRITE_BUFFER_BYTES:
+                    # Compression off the event loop
+                    data = bytes(buffer)
+                    buffer.clear()
+                    await asyncio.to_thread(archive.write, data)
+
+            status = await raw.copy_from_query(query, output=write, format="csv", header=True)
+            archive.write(bytes(buffer))
+            archive.close()
+            # On disk before the partition is dropped
+            file.flush()
+            os.fsync(file.fileno())
+        await asyncio.to_thread(_check_archive, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+    return int(status.split()[-1])
+
+
+def _copy_file(source: Path, target: Path):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(source, target)
+    with open(target, "rb") as file:
+        os.fsync(file.fileno())
+
+
+async def _archive_attachments(conn: AsyncConnection, partition: str) -> List[str]:
+    """
+    Dump the attachment rows of a chat_messages partition next to it and copy
+    their files to ARCHIVE_DIR/chat_attachments/<partition>/. Returns the
+    storage paths, for the caller to delete once the rows are gone.
+    """
+    rows = await conn.execute(text(
+        f"SELECT storage_path, size FROM {ChatAttachment.__tablename__} "
+        f"WHERE message_id IN (SELECT id FROM {partition})"
+    ))
+    stored = rows.all()
+    if not stored:
+        return []
+    copied = await _dump(conn, archive_path(ChatAttachment.__tablename__, partition), _attachments_query(partition))
+    if copied != len(stored):
+        raise RuntimeError(f"archived {copied} of {len(stored)} attachment rows")
+    for storage_path, size in stored:
+        source = attachment_root() / storage_path
+        if not source.is_file():
+            continue
+        target = _attachment_archive_dir(partition) / storage_path
+        await asyncio.to_thread(_copy_file, source, target)
+        if target.stat().st_size != size:
+            raise RuntimeError(f"archived copy of {storage_path} is incomplete")
+    return [storage_path for storage_path, _ in stored]
+
+
+async def _archive_partition(conn: AsyncConnection, table: str, partition: str) -> Path:
+    """Dump a detached partition (and its chat attachments), then drop it; nothing is dropped unless the archive is complete"""
+    rows = (await conn.execute(text(f"SELECT count(*) FROM {partition}"))).scalar()
+    path = archive_path(table, partition)
+    copied = await _dump(conn, path, f"SELECT * FROM {partition}")
+    if copied != rows:
+        raise RuntimeError(f"archived {copied} of {rows} rows")
+    attachments = []
+    if table == ChatMessage.__tablename__:
+        attachments = await _archive_attachments(conn, partition)
+        await conn.execute(text(
+            f"DELETE FROM {ChatAttachment.__tablename__} WHERE message_id IN (SELECT id FROM {partition})"
+        ))
+    await conn.execute(text(f"DROP TABLE {partition}"))
+    await conn.commit()
+    for storage_path in attachments:
+        remove_stored(storage_path)
+    return path
+
+
+async def archive_partitions(conn: AsyncConnection):
+    """Detach, dump and drop the monthly partitions older than each table's retention"""
+    retention = {table: months for table, months in _retention_months().items() if months > 0}
+    if not retention:
+        return
+    if not settings.ARCHIVE_DIR:
+        print("⚠️ Retention is set but ARCHIVE_DIR is not, old partitions are kept")
+        return
+    this_month = date.today().replace(day=1)
+    for table, months in retention.items():
+        if not await _is_partitioned(conn, table):
+            continue
+        cutoff = _add_months(this_month, -months)
+        for name, month in await _partitions(conn, table, attached=True):
+            if month >= cutoff:
+                continue
+            comment = (await conn.execute(text("SELECT obj_description(to_regclass(:n), 'pg_class')"), {"n": name})).scalar()
+            if comment == RESTORED_COMMENT:
+                continue
+            # Don't queue behind long queries while holding up every insert
+            await conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            await conn.commit()
+
+        # Also picks up partitions left detached by an interrupted run
+        for name, month in await _partitions(conn, table, attached=False):
+            if month >= cutoff:
+                continue
+            try:
+                path = await _archive_partition(conn, table, name)
+            except Exception as e:
+                await conn.rollback()
+                # Put the rows back online rather than leave them detached; the next run retries
+                low, high = _bounds(month)
+                await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{low}') TO ('{high}')"))
+                await conn.commit()
+                print(f"⚠️ Could not archive {name}, re-attached it: {e}")
+                continue
+            print(f"📦 Archived {name} to {path}")
+
+
+async def maintain_partitions(conn: AsyncConnection):
+    """Scheduler job: upcoming partitions and archival"""
+    await ensure_partitions(conn)
+    await archive_partitions(conn)
+
+
+# ==================== RESTORE ====================
+
+
+async def _copy_archive(conn: AsyncConnection, path: Path, table: str):
+    """COPY a gzipped CSV archive (with header) into table"""
+    with gzip.open(path, "rb") as archive:
+        columns = archive.readline().decode("utf-8").strip().split(",")
+
+        async def chunks():
+            while True:
+                data = await asyncio.to_thread(archive.read, RESTORE_CHUNK_BYTES)
+                if not data:
+                    return
+                yield data
+
+        raw = (await conn.get_raw_connection()).driver_connection
+        await raw.copy_to_table(table, source=chunks(), columns=columns, format="csv")
+
+
+async def restore_partition(conn: AsyncConnection, path: Path):
+    """
+    Load an archived month back and attach it, with its chat attachments. It
+    is marked so archival leaves it alone; once done, COMMENT ON TABLE it IS
+    NULL and the next run archives it again (the archive files are kept).
+    """
+    match = _PARTITION_NAME.match(path.name.removesuffix(".csv.gz"))
+    if not match:
+        raise ValueError(f"Not an archive file: {path}")
+    table, month = match["table"], date(int(match["year"]), int(match["month"]), 1)
+    name = partition_name(table, month)
+    low, high = _bounds(month)
+
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await _copy_archive(conn, path, name)
+    attachments = archive_path(ChatAttachment.__tablename__, name)
+    if table == ChatMessage.__tablename__ and attachments.exists():
+        await _copy_archive(conn, attachments, ChatAttachment.__tablename__)
+        files = _attachment_archive_dir(name)
+        for source in files.rglob("*"):
+            if source.is_file():
+                await asyncio.to_thread(_copy_file, source, attachment_root() / source.relative_to(files))
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{low}') TO ('{high}')"))
+    await conn.execute(text(f"COMMENT ON TABLE {name} IS '{RESTORED_COMMENT}'"))
+    await conn.commit()
+    print(f"♻️ Restored {name} from {path}")
+
+
+# ==================== MIGRATION ====================
+
+async def migrate_table(conn: AsyncConnection, table):
+    """Turn a plain table into the partitioned one, copying its rows (caller commits)"""
+    legacy = f"{table.name}_legacy"
+    await conn.execute(text(f"LOCK TABLE {table.name} IN ACCESS EXCLUSIVE MODE"))
+    # Free the names the new table needs: table, indexes (incl. the primary key) and id sequence
+    sequence = (await conn.execute(text(f"SELECT pg_get_serial_sequence('{table.name}', 'id')"))).scalar()
+    indexes = (await conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = :t"), {"t": table.name}
+    )).scalars().all()
+    await conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {legacy}"))
+    for index in indexes:
+        await conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_legacy"'))
+    if sequence:
+        await conn.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {legacy}_id_seq"))
+
+    # checkfirst: the enum types already exist
+    await conn.run_sync(lambda sync_conn: table.create(sync_conn, checkfirst=True))
+    first = (await conn.execute(text(f"SELECT min(created_at) FROM {legacy}"))).scalar()
+    month = (first or datetime.now(timezone.utc)).date().replace(day=1)
+    last = _add_months(date.today().replace(day=1), settings.PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        await create_partition(conn, table.name, month)
+        month = _add_months(month, 1)
+
+    columns = ", ".join(column.name for column in table.columns)
+    source = ", ".join(
+        "coalesce(created_at, now())" if column.name == "created_at" else column.name
+        for column in table.columns
+    )
+    await conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {source} FROM {legacy}"))
+    await conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"(SELECT coalesce(max(id), 0) + 1 FROM {legacy}), false)"
+    ))
+    await conn.execute(text(f"DROP TABLE {legacy}"))
+
+
+async def migrate():
+    from app.chat_search import setup_chat_search
+
+    async with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if await _is_partitioned(conn, table.name):
+                print(f"✅ {table.name} is already partitioned")
+                continue
+            print(f"🔄 Partitioning {table.name}...")
+            await migrate_table(conn, table)
+        await setup_chat_search(conn)
+    print("✅ Migration done")
+
+
+async def _main(args: List[str]):
+    try:
+        if args[:1] == ["migrate"]:
+            await migrate()
+        elif args[:1] == ["maintain"]:
+            async with engine.connect() as conn:
+                await maintain_partitions(conn)
+        elif args[:1] == ["restore"] and len(args) == 2:
+            async with engine.connect() as conn:
+                await restore_partition(conn, Path(args[1]))
+        else:
+            print(__doc__)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
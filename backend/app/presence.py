@@ -0,0 +1,123 @@
+"""
+Online presence and typing indicators.
+
+Each worker keeps who is online in memory: user_id -> expiry time. Heartbeats
+(any frame on the chat socket, or POST /chat/presence/heartbeat) extend a
+user's entry by PRESENCE_TTL_SECONDS; a user whose entry has expired is
+offline, so nothing has to be sent when a client simply disappears.
+
+Refreshes are forwarded to the other workers over the event bus, batched every
+FORWARD_INTERVAL_SECONDS and at most once per half TTL per user, so any worker
+can answer "is this user online" without a database query. A remote worker
+may therefore keep a user online up to half a TTL longer than the one that
+received the heartbeat.
+
+Typing uses the same kind of map with a few seconds of TTL. It only throttles
+the typing events sent to the chat partner (once per half TTL); clients show
+the indicator for TYPING_TTL_SECONDS after the last event.
+"""
+import asyncio
+import time
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+from app.events import bus
+
+PRESENCE_CHANNEL = "presence"
+PRESENCE_TTL_SECONDS = 60
+TYPING_TTL_SECONDS = 6
+FORWARD_INTERVAL_SECONDS = 1
+PRUNE_INTERVAL_SECONDS = 30
+PRESENCE_QUEUE_SIZE = 1000
+
+
+class TTLMap:
+    """Keys that stay alive until their expiry time (time.monotonic)"""
+
+    def __init__(self):
+        self._expiry: Dict[Hashable, float] = {}
+        self._next_prune = 0.0
+
+    def touch(self, key: Hashable, ttl: float) -> float:
+        """Keep key alive for ttl seconds, returns how long it had left (0 if it was dead)"""
+        now = time.monotonic()
+        remaining = max(self._expiry.get(key, 0.0) - now, 0.0)
+        self._expiry[key] = max(now + ttl, now + remaining)
+        if now >= self._next_prune:
+            self._prune(now)
+        return remaining
+
+    def discard(self, key: Hashable):
+        self._expiry.pop(key, None)
+
+    def alive(self, key: Hashable) -> bool:
+        return self._expiry.get(key, 0.0) > time.monotonic()
+
+    def _prune(self, now: float):
+        self._expiry = {key: expiry for key, expiry in self._expiry.items() if expiry > now}
+        self._next_prune = now + PRUNE_INTERVAL_SECONDS
+
+
+class Presence:
+    def __init__(self):
+        self._online = TTLMap()
+        self._typing = TTLMap()
+        self._to_forward: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # ==================== ONLINE ====================
+
+    def heartbeat(self, user_id: int):
+        remaining = self._online.touch(user_id, PRESENCE_TTL_SECONDS)
+        if self._task is not None and remaining < PRESENCE_TTL_SECONDS / 2:
+            self._to_forward.add(user_id)
+
+    def is_online(self, user_id: int) -> bool:
+        return self._online.alive(user_id)
+
+    def online(self, user_ids: Iterable[int]) -> Dict[int, bool]:
+        return {user_id: self._online.alive(user_id) for user_id in user_ids}
+
+    # ==================== TYPING ====================
+
+    def typing(self, room_id: int, user_id: int) -> bool:
+        """Record a keystroke, True when the partner should be told (again)"""
+        return self._typing.touch((room_id, user_id), TYPING_TTL_SECONDS) < TYPING_TTL_SECONDS / 2
+
+    def stop_typing(self, room_id: int, user_id: int):
+        self._typing.discard((room_id, user_id))
+
+    # ==================== CROSS-WORKER ====================
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._to_forward.clear()
+
+    async def _run(self):
+        """Forward local heartbeats in batches and apply those of the other workers"""
+        loop = asyncio.get_running_loop()
+        next_forward = loop.time() + FORWARD_INTERVAL_SECONDS
+        async with bus.subscribe(PRESENCE_CHANNEL, maxsize=PRESENCE_QUEUE_SIZE) as sub:
+            while True:
+                event = await sub.get(timeout=max(0, next_forward - loop.time()))
+                # Overflow or resync only loses refreshes: users come back with their next heartbeat
+                sub.overflowed = False
+                if event is not None:
+                    _, payload = event
+                    for user_id in payload.get("users", ()):
+                        self._online.touch(user_id, payload.get("ttl", PRESENCE_TTL_SECONDS))
+                if loop.time() >= next_forward:
+                    if self._to_forward:
+                        users, self._to_forward = sorted(self._to_forward), set()
+                        bus.publish(PRESENCE_CHANNEL, {"users": users, "ttl": PRESENCE_TTL_SECONDS})
+                    next_forward = loop.time() + FORWARD_INTERVAL_SECONDS
+
+
+presence = Presence()
@@ -0,0 +1,187 @@
+"""
+Recurring replenishment orders.
+
+Shops attach weekly or monthly schedules to their active contracts. The
+scheduler calls generate_recurring_orders, which turns every due schedule into
+a PENDING order. Each batch of schedules is handled with a fixed number of
+statements (stock, codes, orders, tracking, rollup, notifications, dates), so
+thousands of contracts cost a few round trips rather than thousands.
+"""
+import calendar
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update, insert, func, or_, bindparam
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config import settings
+from app.models import (
+    Contract, ContractStatus, Shop, Supplier, Order, OrderStatus, OrderTracking,
+    Notification, NotificationType, RecurringOrderSchedule, RecurrenceFrequency
+)
+from app.analytics import record_orders
+from app.inventory import reserve_stock_bulk
+from app.routers.orders import generate_order_codes
+from app.routers.notifications import publish_notifications
+
+Schedule = RecurringOrderSchedule
+
+
+def _add_months(day: date, months: int, anchor_day: Optional[int] = None) -> date:
+    """Same day of month months later (anchor_day if given), clamped to the month's length"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(anchor_day or day.day, calendar.monthrange(year, month)[1]))
+
+
+def next_run_date(
+    current: date, frequency: RecurrenceFrequency, today: date, anchor_day: Optional[int] = None
+) -> date:
+    """
+    First run date after today; periods missed while the scheduler was down are
+    skipped. Monthly runs land on anchor_day, so the 31st is Feb 28 and then
+    Mar 31 again (not the 28th from then on).
+    """
+    if frequency == RecurrenceFrequency.WEEKLY:
+        return current + timedelta(weeks=(today - current).days // 7 + 1)
+    months = (today.year - current.year) * 12 + today.month - current.month
+    following = _add_months(current, months, anchor_day)
+    if following <= today:
+        following = _add_months(current, months + 1, anchor_day)
+    return following
+
+
+async def _deactivate_finished(conn: AsyncConnection, today: date):
+    """Stop schedules whose contract is no longer active or ends before the next run"""
+    await conn.execute(
+        update(Schedule)
+        .where(
+            Schedule.is_active,
+            Schedule.next_run_date <= today,
+            Schedule.contract_id == Contract.id,
+            or_(Contract.status != ContractStatus.ACTIVE, Contract.end_date < Schedule.next_run_date)
+        )
+        .values(is_active=False)
+    )
+    await conn.commit()
+
+
+def _notifications(ready) -> List[dict]:
+    """One notification per user per batch, not one per order"""
+    counts: Dict[tuple, int] = {}
+    for row in ready:
+        for key in ((row.shop_user_id, "/shop/orders"), (row.supplier_user_id, "/supplier/orders")):
+            counts[key] = counts.get(key, 0) + 1
+    return [
+        {
+            "user_id": user_id,
+            "type": NotificationType.ORDER_CREATED,
+            "title": "Đơn hàng định kỳ mới",
+            "message": f"{count} đơn hàng định kỳ đã được tạo tự động",
+            "link": link,
+            "is_read": False,
+        }
+        for (user_id, link), count in counts.items()
+    ]
+
+
+async def generate_recurring_orders(conn: AsyncConnection):
+    """Scheduler job: create the orders of all schedules due today, in batches"""
+    today = date.today()
+    batch_size = settings.RECURRING_ORDER_BATCH_SIZE
+    await _deactivate_finished(conn, today)
+
+    last_id = 0
+    while True:
+        result = await conn.execute(
+            select(
+                Schedule.id, Schedule.contract_id, Schedule.shop_id, Schedule.quantity,
+                Schedule.frequency, Schedule.next_run_date, Schedule.anchor_day, Schedule.shipping_address,
+                Schedule.note, Schedule.payment_method,
+                Contract.supplier_id, Contract.product_id, Contract.agreed_price,
+                Shop.user_id.label("shop_user_id"), Supplier.user_id.label("supplier_user_id"),
+            )
+            .join(Contract, Contract.id == Schedule.contract_id)
+            .join(Shop, Shop.id == Schedule.shop_id)
+            .join(Supplier, Supplier.id == Contract.supplier_id)
+            .where(Schedule.is_active, Schedule.next_run_date <= today, Schedule.id > last_id)
+            .order_by(Schedule.id)
+            .limit(batch_size)
+            .with_for_update(of=Schedule, skip_locked=True)
+        )
+        due = result.all()
+        if not due:
+            break
+        last_id = due[-1].id
+
+        # Stock for the whole batch in one UPDATE; schedules of products that are
+        # short stay due and are retried on the next sweep
+        wanted: Dict[int, int] = {}
+        for row in due:
+            wanted[row.product_id] = wanted.get(row.product_id, 0) + row.quantity
+        reserved = await reserve_stock_bulk(conn, wanted)
+        ready = [row for row in due if row.product_id in reserved]
+
+        notified = []
+        if ready:
+            codes = await generate_order_codes(conn, len(ready))
+            result = await conn.execute(
+                insert(Order).returning(Order.id, sort_by_parameter_order=True),
+                [
+                    {
+                        "order_code": code,
+                        "contract_id": row.contract_id,
+                        "supplier_id": row.supplier_id,
+                        "shop_id": row.shop_id,
+                        "quantity": row.quantity,
+                        "unit_price": row.agreed_price,
+                        "total_amount": row.agreed_price * row.quantity,
+                        "shipping_address": row.shipping_address,
+                        "note": row.note,
+                        "status": OrderStatus.PENDING,
+                        "payment_method": row.payment_method,
+                        "stock_reserved": True,
+                    }
+                    for row, code in zip(ready, codes)
+                ]
+            )
+            order_ids = result.scalars().all()
+
+            await conn.execute(
+                insert(OrderTracking),
+                [
+                    {
+                        "order_id": order_id,
+                        "status": OrderStatus.PENDING,
+                        "note": "Đơn hàng định kỳ",
+                        "updated_by": row.shop_user_id,
+                    }
+                    for row, order_id in zip(ready, order_ids)
+                ]
+            )
+            await record_orders(conn, order_ids)
+
+            await conn.execute(
+                update(Schedule)
+                .where(Schedule.id == bindparam("schedule_id"))
+                .values(next_run_date=bindparam("next_date"), last_run_at=func.now()),
+                [
+                    {"schedule_id": row.id, "next_date": next_run_date(row.next_run_date, row.frequency, today, row.anchor_day)}
+                    for row in ready
+                ]
+            )
+
+            result = await conn.execute(
+                insert(Notification).returning(Notification.id, Notification.user_id),
+                _notifications(ready)
+            )
+            notified = result.all()
+        await conn.commit()
+        publish_notifications(notified)
+
+        if ready:
+            print(f"🔁 Created {len(ready)} recurring orders")
+        if len(ready) < len(due):
+            print(f"⚠️ {len(due) - len(ready)} recurring orders postponed: not enough stock")
+        if len(due) < batch_size:
+            break
@@ -9,6 +9,8 @@ from . import quotes
 from . import negotiations
 from . import contracts
 from . import orders  # <-- Thêm dòng này
+from . import recurring_orders
+from . import analytics
 from . import chat
 from . import notifications
 from . import upload
@@ -0,0 +1,125 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, cast, Date
+from typing import Optional
+from datetime import date, timedelta
+
+from app.database import get_db
+from app.models import User, Supplier, Shop, Product, OrderDailyRollup
+from app.auth import get_supplier_user
+
+router = APIRouter()
+
+
+@router.get("/supplier")
+async def get_supplier_analytics(
+    date_from: Optional[date] = Query(None, description="Default: 30 days ago"),
+    date_to: Optional[date] = Query(None, description="Default: today"),
+    granularity: str = Query("day", pattern="^(day|month)$"),
+    top: int = Query(10, ge=1, le=50),
+    current_user: User = Depends(get_supplier_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Revenue by day/month plus top shops and products (reads only the daily rollup)"""
+    result = await db.execute(select(Supplier.id).where(Supplier.user_id == current_user.id))
+    supplier_id = result.scalar_one_or_none()
+    if not supplier_id:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=30)
+    in_range = (
+        OrderDailyRollup.supplier_id == supplier_id,
+        OrderDailyRollup.day >= date_from,
+        OrderDailyRollup.day <= date_to,
+    )
+    order_count = func.sum(OrderDailyRollup.order_count)
+    quantity = func.sum(OrderDailyRollup.quantity)
+    total_amount = func.sum(OrderDailyRollup.total_amount)
+    
+    # Time series
+    if granularity == "month":
+        period = cast(func.date_trunc("month", OrderDailyRollup.day), Date)
+    else:
+        period = OrderDailyRollup.day
+    result = await db.execute(
+        select(period.label("period"), order_count, quantity, total_amount)
+        .where(*in_range)
+        .group_by(period)
+        .order_by(period)
+    )
+    series = [
+        {
+            "period": row[0].isoformat(),
+            "order_count": int(row[1] or 0),
+            "quantity": int(row[2] or 0),
+            "total_amount": float(row[3] or 0),
+        }
+        for row in result.all()
+    ]
+    
+    # Top shops
+    top_shops_sub = (
+        select(OrderDailyRollup.shop_id, order_count.label("order_count"), total_amount.label("total_amount"))
+        .where(*in_range)
+        .group_by(OrderDailyRollup.shop_id)
+        .order_by(total_amount.desc())
+        .limit(top)
+        .subquery()
+    )
+    result = await db.execute(
+        select(top_shops_sub, Shop.shop_name)
+        .join(Shop, Shop.id == top_shops_sub.c.shop_id)
+        .order_by(top_shops_sub.c.total_amount.desc())
+    )
+    top_shops = [
+        {
+            "shop_id": row.shop_id,
+            "shop_name": row.shop_name,
+            "order_count": int(row.order_count or 0),
+            "total_amount": float(row.total_amount or 0),
+        }
+        for row in result.all()
+    ]
+    
+    # Top products
+    top_products_sub = (
+        select(
+            OrderDailyRollup.product_id,
+            quantity.label("quantity"),
+            total_amount.label("total_amount")
+        )
+        .where(*in_range)
+        .group_by(OrderDailyRollup.product_id)
+        .order_by(total_amount.desc())
+        .limit(top)
+        .subquery()
+    )
+    result = await db.execute(
+        select(top_products_sub, Product.name)
+        .join(Product, Product.id == top_products_sub.c.product_id)
+        .order_by(top_products_sub.c.total_amount.desc())
+    )
+    top_products = [
+        {
+            "product_id": row.product_id,
+            "name": row.name,
+            "quantity": int(row.quantity or 0),
+            "total_amount": float(row.total_amount or 0),
+        }
+        for row in result.all()
+    ]
+    
+    return {
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "granularity": granularity,
+        "totals": {
+            "order_count": sum(p["order_count"] for p in series),
+            "quantity": sum(p["quantity"] for p in series),
+            "total_amount": sum(p["total_amount"] for p in series),
+        },
+        "series": series,
+        "top_shops": top_shops,
+        "top_products": top_products,
+    }
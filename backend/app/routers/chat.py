@@ -1,71 +1,196 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_, func
-from sqlalchemy.orm import selectinload
-from typing import List
-
-from app.database import get_db
-from app.models import User, Supplier, Shop, ChatRoom, ChatMessage, Notification, NotificationType
-from app.schemas import ChatRoomResponse, ChatMessageCreate, ChatMessageResponse
-from app.auth import get_current_user
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+from sqlalchemy import select, and_, func, true, tuple_, text
+from sqlalchemy.orm import selectinload, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from typing import Dict, List, Optional
+from pathlib import Path
+
+from app.database import get_db, AsyncSessionLocal
+from app.models import User, Supplier, Shop, ChatRoom, ChatRoomMember, ChatMessage, ChatAttachment, Notification, NotificationType
+from app.schemas import ChatRoomResponse, ChatMessageCreate, ChatMessageResponse, ChatSearchPage
+from app.auth import get_current_user, decode_token
 from app.routers.notifications import create_notification
+from app.events import bus, chat_channel
+from app.presence import presence, PRESENCE_TTL_SECONDS
+from app.chat_search import search_vector, search_query, headline, snippet_html, parse_cursor, format_cursor
+from app.attachments import attachment_root, store_stream, remove_stored, download_headers, parse_range, read_chunks
+from app.config import settings
 
 router = APIRouter()
 
+# WebSocket heartbeat / backpressure
+WS_PING_INTERVAL_SECONDS = 25
+WS_IDLE_TIMEOUT_SECONDS = 60      # No frame from the client for this long: connection is dead
+WS_SEND_TIMEOUT_SECONDS = 10
+WS_QUEUE_SIZE = 100               # Undelivered events per socket before it is dropped
+
+MESSAGE_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+
 async def get_or_create_chat_room(db: AsyncSession, supplier_id: int, shop_id: int) -> ChatRoom:
-    """Get existing chat room or create new one"""
+    """
+    Get existing chat room or create new one. The insert is a no-op when the
+    room exists (unique supplier/shop pair), so concurrent first messages
+    cannot create duplicates; the select only runs in that case.
+    """
+    result = await db.scalars(
+        pg_insert(ChatRoom)
+        .values(supplier_id=supplier_id, shop_id=shop_id)
+        .on_conflict_do_nothing(index_elements=["supplier_id", "shop_id"])
+        .returning(ChatRoom)
+    )
+    chat_room = result.one_or_none()
+    if chat_room is not None:
+        return chat_room
+    
     result = await db.execute(
         select(ChatRoom).where(
             ChatRoom.supplier_id == supplier_id,
             ChatRoom.shop_id == shop_id
         )
     )
-    chat_room = result.scalar_one_or_none()
-    
-    if not chat_room:
-        chat_room = ChatRoom(supplier_id=supplier_id, shop_id=shop_id)
-        db.add(chat_room)
-        await db.flush()
-    
-    return chat_room
+    return result.scalar_one()
+
+async def ensure_unique_chat_rooms(conn: AsyncConnection):
+    """
+    Add the supplier/shop unique constraint to an existing chat_rooms table,
+    merging duplicate rooms into the oldest one first (messages and read
+    watermarks move over). No-op once the constraint exists.
+    """
+    exists = await conn.scalar(text("SELECT to_regclass('uq_chat_rooms_supplier_shop')"))
+    if exists is not None:
+        return
+    await conn.execute(text("LOCK TABLE chat_rooms IN SHARE ROW EXCLUSIVE MODE"))
+    await conn.execute(text("""
+        CREATE TEMP TABLE chat_room_duplicates ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, min(id) OVER (PARTITION BY supplier_id, shop_id) AS keep_id FROM chat_rooms
+        ) ranked
+        WHERE id <> keep_id
+    """))
+    merged = await conn.scalar(text("SELECT count(*) FROM chat_room_duplicates"))
+    if merged:
+        await conn.execute(text("""
+            UPDATE chat_messages m SET chat_room_id = d.keep_id
+            FROM chat_room_duplicates d WHERE m.chat_room_id = d.id
+        """))
+        await conn.execute(text("""
+            INSERT INTO chat_room_members (chat_room_id, user_id, last_read_message_id)
+            SELECT d.keep_id, m.user_id, max(m.last_read_message_id)
+            FROM chat_room_members m JOIN chat_room_duplicates d ON d.id = m.chat_room_id
+            GROUP BY d.keep_id, m.user_id
+            ON CONFLICT (chat_room_id, user_id) DO UPDATE SET last_read_message_id =
+                GREATEST(chat_room_members.last_read_message_id, excluded.last_read_message_id)
+        """))
+        await conn.execute(text(
+            "DELETE FROM chat_room_members WHERE chat_room_id IN (SELECT id FROM chat_room_duplicates)"
+        ))
+        await conn.execute(text("DELETE FROM chat_rooms WHERE id IN (SELECT id FROM chat_room_duplicates)"))
+    await conn.execute(text(
+        "ALTER TABLE chat_rooms ADD CONSTRAINT uq_chat_rooms_supplier_shop UNIQUE (supplier_id, shop_id)"
+    ))
+    await conn.commit()
+    print(f"🔒 Added unique constraint on chat rooms ({merged} duplicate rooms merged)")
+
+async def _room_filter(db: AsyncSession, current_user: User):
+    """WHERE clause selecting the current user's rooms, None for other roles"""
+    if current_user.role.value == "supplier":
+        result = await db.execute(select(Supplier.id).where(Supplier.user_id == current_user.id))
+        return ChatRoom.supplier_id == result.scalar_one_or_none()
+    if current_user.role.value == "shop":
+        result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+        return ChatRoom.shop_id == result.scalar_one_or_none()
+    return None
+
+def _unread_messages(user_id: int, room_filter):
+    """
+    Messages from the other participant past the user's read watermark (none:
+    nothing read), a range on (chat_room_id, id). Legacy is_read flags were
+    turned into watermarks once by app/migrations.py.
+    """
+    member = aliased(ChatRoomMember)
+    return (
+        select(ChatMessage.chat_room_id)
+        .join(ChatRoom, ChatRoom.id == ChatMessage.chat_room_id)
+        .outerjoin(member, and_(member.chat_room_id == ChatRoom.id, member.user_id == user_id))
+        .where(
+            room_filter,
+            ChatMessage.sender_id != user_id,
+            ChatMessage.id > func.coalesce(member.last_read_message_id, 0)
+        )
+    )
+
+async def _read_watermarks(db: AsyncSession, room_ids: List[int]) -> Dict[tuple, int]:
+    """{(room_id, user_id): last_read_message_id} for the given rooms"""
+    if not room_ids:
+        return {}
+    result = await db.execute(
+        select(ChatRoomMember.chat_room_id, ChatRoomMember.user_id, ChatRoomMember.last_read_message_id)
+        .where(ChatRoomMember.chat_room_id.in_(room_ids))
+    )
+    return {(room_id, user_id): last_read for room_id, user_id, last_read in result.all()}
+
+def _apply_read_state(room: ChatRoom, messages, watermarks: Dict[tuple, int]):
+    """Set each message's is_read from its recipient's watermark (not persisted)"""
+    participants = (room.supplier.user_id, room.shop.user_id)
+    for message in messages:
+        if message is None:
+            continue
+        recipient = participants[1] if message.sender_id == participants[0] else participants[0]
+        last_read = watermarks.get((room.id, recipient), 0)
+        set_committed_value(message, "is_read", message.id <= last_read)
 
 @router.get("/rooms", response_model=List[ChatRoomResponse])
 async def get_chat_rooms(
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all chat rooms for current user"""
-    query = select(ChatRoom).options(
-        selectinload(ChatRoom.supplier).selectinload(Supplier.user),
-        selectinload(ChatRoom.shop).selectinload(Shop.user),
-        selectinload(ChatRoom.messages).selectinload(ChatMessage.sender)
-    )
+    """Get all chat rooms for current user, with last message, unread count and partner presence"""
+    room_filter = await _room_filter(db, current_user)
+    if room_filter is None:
+        return []
     
-    if current_user.role.value == "supplier":
-        supplier_result = await db.execute(
-            select(Supplier).where(Supplier.user_id == current_user.id)
-        )
-        supplier = supplier_result.scalar_one_or_none()
-        if supplier:
-            query = query.where(ChatRoom.supplier_id == supplier.id)
-    elif current_user.role.value == "shop":
-        shop_result = await db.execute(
-            select(Shop).where(Shop.user_id == current_user.id)
+    # Latest message per room via LATERAL on (chat_room_id, id): one index probe per room
+    latest = aliased(ChatMessage)
+    last = (
+        select(latest.id)
+        .where(latest.chat_room_id == ChatRoom.id)
+        .order_by(latest.id.desc())
+        .limit(1)
+        .correlate(ChatRoom)
+        .lateral("last_message")
+    )
+    result = await db.execute(
+        select(ChatRoom, ChatMessage)
+        .select_from(ChatRoom)
+        .outerjoin(last, true())
+        .outerjoin(ChatMessage, ChatMessage.id == last.c.id)
+        .options(
+            selectinload(ChatRoom.supplier),
+            selectinload(ChatRoom.shop),
+            selectinload(ChatMessage.sender)
         )
-        shop = shop_result.scalar_one_or_none()
-        if shop:
-            query = query.where(ChatRoom.shop_id == shop.id)
-    else:
-        return []
+        .where(room_filter)
+        .order_by(ChatRoom.updated_at.desc())
+    )
+    rows = result.all()
+    
+    unread = _unread_messages(current_user.id, room_filter).subquery()
+    result = await db.execute(
+        select(unread.c.chat_room_id, func.count()).group_by(unread.c.chat_room_id)
+    )
+    unread_counts = dict(result.all())
     
-    query = query.order_by(ChatRoom.updated_at.desc())
-    result = await db.execute(query)
-    rooms = result.scalars().all()
+    watermarks = await _read_watermarks(db, [room.id for room, _ in rows])
+    for room, last_message in rows:
+        _apply_read_state(room, [last_message], watermarks)
     
-    # Add last message and unread count
-    response = []
-    for room in rooms:
-        room_dict = {
+    return [
+        {
             "id": room.id,
             "supplier_id": room.supplier_id,
             "shop_id": room.shop_id,
@@ -74,27 +199,26 @@ async def get_chat_rooms(
             "supplier": room.supplier,
             "shop": room.shop,
             "messages": [],
-            "last_message": room.messages[-1] if room.messages else None,
-            "unread_count": sum(1 for m in room.messages if not m.is_read and m.sender_id != current_user.id)
+            "last_message": last_message,
+            "unread_count": unread_counts.get(room.id, 0),
+            "partner_online": _partner_online(room, current_user)
         }
-        response.append(room_dict)
-    
-    return response
+        for room, last_message in rows
+    ]
 
-@router.get("/rooms/{room_id}", response_model=ChatRoomResponse)
-async def get_chat_room(
-    room_id: int,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """Get chat room with messages"""
+def _partner_online(room: ChatRoom, current_user: User) -> Optional[bool]:
+    """Whether the other participant is online, from the in-memory presence map"""
+    if current_user.role.value == "supplier":
+        return presence.is_online(room.shop.user_id)
+    if current_user.role.value == "shop":
+        return presence.is_online(room.supplier.user_id)
+    return None
+
+async def _get_room_for_user(db: AsyncSession, room_id: int, current_user: User) -> ChatRoom:
+    """Load a room with its supplier and shop, 404 / 403 unless the user is a participant"""
     result = await db.execute(
         select(ChatRoom)
-        .options(
-            selectinload(ChatRoom.supplier).selectinload(Supplier.user),
-            selectinload(ChatRoom.shop).selectinload(Shop.user),
-            selectinload(ChatRoom.messages).selectinload(ChatMessage.sender)
-        )
+        .options(selectinload(ChatRoom.supplier), selectinload(ChatRoom.shop))
         .where(ChatRoom.id == room_id)
     )
     room = result.scalar_one_or_none()
@@ -103,25 +227,80 @@ async def get_chat_room(
     
     # Verify access
     if current_user.role.value == "supplier":
-        supplier_result = await db.execute(
-            select(Supplier).where(Supplier.user_id == current_user.id)
-        )
-        supplier = supplier_result.scalar_one_or_none()
-        if not supplier or room.supplier_id != supplier.id:
+        if room.supplier.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="Access denied")
     elif current_user.role.value == "shop":
-        shop_result = await db.execute(
-            select(Shop).where(Shop.user_id == current_user.id)
-        )
-        shop = shop_result.scalar_one_or_none()
-        if not shop or room.shop_id != shop.id:
+        if room.shop.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="Access denied")
+    return room
+
+async def _fetch_messages(
+    db: AsyncSession,
+    room_id: int,
+    after_id: Optional[int],
+    before_id: Optional[int],
+    limit: int
+) -> List[ChatMessage]:
+    """A page of a room's history on (chat_room_id, id), always returned oldest first"""
+    query = (
+        select(ChatMessage)
+        .options(selectinload(ChatMessage.sender))
+        .where(ChatMessage.chat_room_id == room_id)
+    )
+    
+    if after_id is None:
+        # Latest page, or the page just before the cursor when scrolling back
+        if before_id is not None:
+            query = query.where(ChatMessage.id < before_id)
+        result = await db.execute(query.order_by(ChatMessage.id.desc()).limit(limit))
+        return list(reversed(result.scalars().all()))
+    
+    query = query.where(ChatMessage.id > after_id)
+    if before_id is not None:
+        query = query.where(ChatMessage.id < before_id)
+    result = await db.execute(query.order_by(ChatMessage.id.asc()).limit(limit))
+    return list(result.scalars().all())
+
+async def _mark_room_read(db: AsyncSession, room_id: int, user_id: int, up_to: Optional[int] = None):
+    """
+    Advance the user's read watermark to message `up_to` (default: the room's
+    latest message) with a single upsert; it never moves backwards.
+    """
+    if up_to is None:
+        up_to = (
+            select(func.coalesce(func.max(ChatMessage.id), 0))
+            .where(ChatMessage.chat_room_id == room_id)
+            .scalar_subquery()
+        )
+    stmt = pg_insert(ChatRoomMember).values(chat_room_id=room_id, user_id=user_id, last_read_message_id=up_to)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["chat_room_id", "user_id"],
+            set_={
+                "last_read_message_id": func.greatest(
+                    ChatRoomMember.last_read_message_id, stmt.excluded.last_read_message_id
+                ),
+                "updated_at": func.now(),
+            }
+        )
+    )
+
+@router.get("/rooms/{room_id}", response_model=ChatRoomResponse)
+async def get_chat_room(
+    room_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Open a chat room: room info and its latest page of messages, marked read.
+    Older messages: GET /chat/rooms/{room_id}/messages?before_id=
+    """
+    room = await _get_room_for_user(db, room_id, current_user)
     
-    # Mark messages as read
-    for msg in room.messages:
-        if msg.sender_id != current_user.id and not msg.is_read:
-            msg.is_read = True
+    await _mark_room_read(db, room_id, current_user.id)
     await db.commit()
+    messages = await _fetch_messages(db, room_id, None, None, MESSAGE_PAGE_SIZE)
+    _apply_read_state(room, messages, await _read_watermarks(db, [room_id]))
     
     return {
         "id": room.id,
@@ -131,11 +310,37 @@ async def get_chat_room(
         "updated_at": room.updated_at,
         "supplier": room.supplier,
         "shop": room.shop,
-        "messages": room.messages,
-        "last_message": room.messages[-1] if room.messages else None,
-        "unread_count": 0
+        "messages": messages,
+        "last_message": messages[-1] if messages else None,
+        "unread_count": 0,
+        "partner_online": _partner_online(room, current_user)
     }
 
+@router.get("/rooms/{room_id}/messages", response_model=List[ChatMessageResponse])
+async def get_chat_messages(
+    room_id: int,
+    before_id: Optional[int] = Query(None, description="Only messages older than this id (scroll back)"),
+    after_id: Optional[int] = Query(None, description="Only messages newer than this id (catch up)"),
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=200),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Page through a room's messages, oldest first.
+    
+    - no cursor: the latest `limit` messages
+    - `before_id`: the `limit` messages just before it
+    - `after_id`: up to `limit` messages after it; these are marked read
+    """
+    room = await _get_room_for_user(db, room_id, current_user)
+    
+    messages = await _fetch_messages(db, room_id, after_id, before_id, limit)
+    if after_id is not None and messages:
+        await _mark_room_read(db, room_id, current_user.id, up_to=messages[-1].id)
+        await db.commit()
+    _apply_read_state(room, messages, await _read_watermarks(db, [room_id]))
+    return messages
+
 @router.post("/rooms/with/{partner_user_id}", response_model=ChatRoomResponse)
 async def create_or_get_chat_room(
     partner_user_id: int,
@@ -185,17 +390,18 @@ async def create_or_get_chat_room(
     
     await db.commit()
     
-    # Reload with relationships
+    # Reload with relationships, and only the latest page of messages
     result = await db.execute(
         select(ChatRoom)
         .options(
             selectinload(ChatRoom.supplier).selectinload(Supplier.user),
-            selectinload(ChatRoom.shop).selectinload(Shop.user),
-            selectinload(ChatRoom.messages)
+            selectinload(ChatRoom.shop).selectinload(Shop.user)
         )
         .where(ChatRoom.id == room.id)
     )
     room = result.scalar_one()
+    messages = await _fetch_messages(db, room.id, None, None, MESSAGE_PAGE_SIZE)
+    _apply_read_state(room, messages, await _read_watermarks(db, [room.id]))
     
     return {
         "id": room.id,
@@ -205,19 +411,24 @@ async def create_or_get_chat_room(
         "updated_at": room.updated_at,
         "supplier": room.supplier,
         "shop": room.shop,
-        "messages": room.messages,
-        "last_message": room.messages[-1] if room.messages else None,
-        "unread_count": 0
+        "messages": messages,
+        "last_message": messages[-1] if messages else None,
+        "unread_count": 0,
+        "partner_online": _partner_online(room, current_user)
     }
 
-@router.post("/rooms/{room_id}/messages", response_model=ChatMessageResponse)
-async def send_message(
+async def _send_chat_message(
+    db: AsyncSession,
     room_id: int,
-    data: ChatMessageCreate,
-    current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """Send a message to chat room"""
+    current_user: User,
+    text: str,
+    attachment: Optional[ChatAttachment] = None
+) -> ChatMessage:
+    """
+    Store a message, notify the receiver and push it to both participants'
+    chat channels after commit. Shared by the REST endpoint and the socket.
+    An attachment is stored with the message, in the same transaction.
+    """
     result = await db.execute(
         select(ChatRoom)
         .options(
@@ -258,26 +469,34 @@ async def send_message(
     message = ChatMessage(
         chat_room_id=room_id,
         sender_id=current_user.id,
-        message=data.message
+        message=text
     )
     db.add(message)
     
+    if attachment is not None:
+        await db.flush()
+        attachment.message_id = message.id
+        db.add(attachment)
+    
     # Update room updated_at
     room.updated_at = func.now()
     
     # Create notification for receiver
     if receiver_user_id:
-        await create_notification(
+        create_notification(
             db=db,
             user_id=receiver_user_id,
             notification_type="new_message",  # <-- SỬA TỪ type= THÀNH notification_type=
             title="Tin nhắn mới",
-            message=f"{sender_name}: {data.message[:50]}{'...' if len(data.message) > 50 else ''}",
+            message=f"{sender_name}: {text[:50]}{'...' if len(text) > 50 else ''}",
             link=f"/chat/{room_id}"
         )
     
     await db.commit()
-    await db.refresh(message)
+    
+    # Live sockets of both participants (all their tabs) re-read the message by id
+    for user_id in {room.supplier.user_id, room.shop.user_id}:
+        bus.publish(chat_channel(user_id), {"room_id": room_id, "id": message.id})
     
     # Load sender relationship
     result = await db.execute(
@@ -285,9 +504,278 @@ async def send_message(
         .options(selectinload(ChatMessage.sender))
         .where(ChatMessage.id == message.id)
     )
-    message = result.scalar_one()
+    return result.scalar_one()
+
+@router.post("/rooms/{room_id}/messages", response_model=ChatMessageResponse)
+async def send_message(
+    room_id: int,
+    data: ChatMessageCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Send a message to chat room"""
+    return await _send_chat_message(db, room_id, current_user, data.message)
+
+# ==================== ATTACHMENTS ====================
+
+@router.post("/rooms/{room_id}/attachments", response_model=ChatMessageResponse)
+async def upload_attachment(
+    room_id: int,
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    message: Optional[str] = Query(None, max_length=2000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Send a file to a chat room. The request body is the raw file (not
+    multipart) with its Content-Type; it is streamed to disk, never held in
+    memory. Returns the message carrying the attachment. Idempotency-Key is
+    ignored here (app/idempotency.py would have to buffer the body).
+    """
+    if current_user.role.value not in ("supplier", "shop"):
+        raise HTTPException(status_code=403, detail="Access denied")
+    await _get_room_for_user(db, room_id, current_user)
+    # Don't hold a connection for the duration of the upload
+    await db.commit()
     
-    return message
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.ATTACHMENT_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File size exceeds {settings.ATTACHMENT_MAX_BYTES // (1024 * 1024)}MB limit"
+        )
+    name = Path(filename.replace("\\", "/")).name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Tên file không hợp lệ")
+    content_type = (request.headers.get("content-type") or "").split(";")[0].strip()[:100]
+    
+    stored = await store_stream(request.stream(), str(room_id))
+    attachment = ChatAttachment(
+        chat_room_id=room_id,
+        uploader_id=current_user.id,
+        filename=name,
+        content_type=content_type or "application/octet-stream",
+        size=stored.size,
+        sha256=stored.sha256,
+        storage_path=stored.path
+    )
+    try:
+        return await _send_chat_message(db, room_id, current_user, message or f"📎 {name}", attachment)
+    except BaseException:
+        remove_stored(stored.path)
+        raise
+
+@router.get("/attachments/{attachment_id}")
+async def download_attachment(
+    attachment_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Download an attachment; a single "Range: bytes=..." is answered with 206"""
+    attachment = await db.get(ChatAttachment, attachment_id)
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    await _get_room_for_user(db, attachment.chat_room_id, current_user)
+    await db.commit()
+    if not (attachment_root() / attachment.storage_path).is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    etag = f'"{attachment.sha256}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        **download_headers(attachment.filename, attachment.content_type),
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    size = attachment.size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), size)
+    
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        read_chunks(attachment.storage_path, start, end),
+        status_code=status_code,
+        media_type=attachment.content_type,
+        headers=headers
+    )
+
+# ==================== WEBSOCKET ====================
+
+async def _load_message(message_id: int) -> Optional[dict]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(ChatMessage)
+            .options(selectinload(ChatMessage.sender))
+            .where(ChatMessage.id == message_id)
+        )
+        message = result.scalar_one_or_none()
+        if message is None:
+            return None
+        return ChatMessageResponse.model_validate(message).model_dump(mode="json")
+
+async def _socket_send(websocket: WebSocket, payload: dict):
+    # A client that stops reading must not block the writer forever
+    await asyncio.wait_for(websocket.send_json(payload), WS_SEND_TIMEOUT_SECONDS)
+
+async def _room_partner(user_id: int, room_id: int) -> Optional[int]:
+    """User id of the other participant of room_id, None unless user_id takes part in it"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Supplier.user_id, Shop.user_id)
+            .select_from(ChatRoom)
+            .join(Supplier, Supplier.id == ChatRoom.supplier_id)
+            .join(Shop, Shop.id == ChatRoom.shop_id)
+            .where(ChatRoom.id == room_id)
+        )
+        row = result.first()
+    if row is None or user_id not in row:
+        return None
+    return row[1] if row[0] == user_id else row[0]
+
+async def _socket_reader(websocket: WebSocket, user_id: int, last_seen: list):
+    """Handle frames from the client: sends, typing, pings and pongs"""
+    partners: Dict[int, Optional[int]] = {}  # room_id -> partner user id, looked up once per socket
+    while True:
+        data = await websocket.receive_json()
+        last_seen[0] = asyncio.get_running_loop().time()
+        presence.heartbeat(user_id)
+        if not isinstance(data, dict):
+            continue
+        kind = data.get("type")
+        if kind == "ping":
+            await _socket_send(websocket, {"type": "pong"})
+        elif kind == "typing":
+            room_id = data.get("room_id")
+            if not isinstance(room_id, int):
+                continue
+            if room_id not in partners:
+                partners[room_id] = await _room_partner(user_id, room_id)
+            if partners[room_id] is not None and presence.typing(room_id, user_id):
+                bus.publish(chat_channel(partners[room_id]), {"typing": room_id, "user_id": user_id})
+        elif kind == "send":
+            client_id = data.get("client_id")
+            text = data.get("message")
+            if not isinstance(text, str) or not text.strip() or not isinstance(data.get("room_id"), int):
+                await _socket_send(websocket, {"type": "error", "client_id": client_id, "detail": "Invalid message"})
+                continue
+            # Short-lived session per send: a socket must not hold a pool connection while idle
+            async with AsyncSessionLocal() as db:
+                user = await db.get(User, user_id)
+                try:
+                    message = await _send_chat_message(db, data["room_id"], user, text)
+                except HTTPException as e:
+                    await _socket_send(websocket, {"type": "error", "client_id": client_id, "detail": e.detail})
+                    continue
+                # Next keystroke announces typing again straight away
+                presence.stop_typing(data["room_id"], user_id)
+                payload = ChatMessageResponse.model_validate(message).model_dump(mode="json")
+            await _socket_send(websocket, {"type": "sent", "client_id": client_id, "message": payload})
+
+async def _socket_writer(websocket: WebSocket, sub, last_seen: list):
+    """Push committed messages, typing events and heartbeats; close idle or overflowing sockets"""
+    loop = asyncio.get_running_loop()
+    next_ping = loop.time() + WS_PING_INTERVAL_SECONDS
+    while True:
+        event = await sub.get(timeout=max(0, next_ping - loop.time()))
+        if sub.overflowed:
+            # Client reads slower than messages arrive: drop it, it resyncs over REST on reconnect
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+        if event is not None:
+            _, payload = event
+            if payload.get("resync"):
+                # Events may have been lost (bus reconnected): client re-reads with after_id
+                await _socket_send(websocket, {"type": "resync"})
+                continue
+            if "typing" in payload:
+                await _socket_send(websocket, {"type": "typing", "room_id": payload["typing"], "user_id": payload["user_id"]})
+                continue
+            message = await _load_message(payload["id"])
+            if message is not None:
+                await _socket_send(websocket, {"type": "message", "message": message})
+        if loop.time() >= next_ping:
+            if loop.time() - last_seen[0] > WS_IDLE_TIMEOUT_SECONDS:
+                await websocket.close(code=status.WS_1001_GOING_AWAY)
+                return
+            await _socket_send(websocket, {"type": "ping"})
+            next_ping = loop.time() + WS_PING_INTERVAL_SECONDS
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket, token: str = Query(...)):
+    """
+    Real-time chat: `/chat/ws?token=<access token>`.
+    
+    Server -> client: {"type": "message", "message": {...}} for every message
+    committed in one of the user's rooms, {"type": "sent", "client_id", "message"}
+    acknowledging a send, {"type": "typing", "room_id", "user_id"} (show it for
+    TYPING_TTL_SECONDS), {"type": "error", ...}, {"type": "ping"} and
+    {"type": "resync"} (messages may have been missed, re-read with after_id).
+    Client -> server: {"type": "send", "room_id", "message", "client_id"?},
+    {"type": "typing", "room_id"} on keystrokes, {"type": "pong"} / {"type": "ping"}.
+    Every frame counts as a presence heartbeat. Sockets silent for longer than
+    WS_IDLE_TIMEOUT_SECONDS are closed.
+    """
+    token_data = decode_token(token)
+    if token_data is None or token_data.user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, token_data.user_id)
+    if user is None or user.role.value not in ("supplier", "shop"):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    presence.heartbeat(user.id)
+    last_seen = [asyncio.get_running_loop().time()]
+    async with bus.subscribe(chat_channel(user.id), maxsize=WS_QUEUE_SIZE) as sub:
+        tasks = [
+            asyncio.create_task(_socket_reader(websocket, user.id, last_seen)),
+            asyncio.create_task(_socket_writer(websocket, sub, last_seen)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    for task in done:
+        error = task.exception()
+        if isinstance(error, asyncio.TimeoutError):
+            # Send timed out: the client is not reading
+            try:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            except RuntimeError:
+                pass
+        elif error is not None and not isinstance(error, WebSocketDisconnect):
+            print(f"⚠️ Chat socket error: {error}")
+
+@router.post("/presence/heartbeat")
+async def presence_heartbeat(current_user: User = Depends(get_current_user)):
+    """Mark the current user online for PRESENCE_TTL_SECONDS (clients without the chat socket)"""
+    presence.heartbeat(current_user.id)
+    return {"ttl": PRESENCE_TTL_SECONDS}
+
+@router.get("/presence")
+async def get_presence(
+    user_ids: Optional[List[int]] = Query(None, max_length=200),
+    current_user: User = Depends(get_current_user)
+):
+    """Online status of the given users (?user_ids=1&user_ids=2), answered from memory"""
+    return {str(user_id): online for user_id, online in presence.online(user_ids or []).items()}
 
 @router.get("/unread-count")
 async def get_total_unread_count(
@@ -295,28 +783,73 @@ async def get_total_unread_count(
     db: AsyncSession = Depends(get_db)
 ):
     """Get total unread message count"""
-    query = select(ChatRoom)
+    room_filter = await _room_filter(db, current_user)
+    if room_filter is None:
+        return {"count": 0}
     
-    if current_user.role.value == "supplier":
-        supplier_result = await db.execute(
-            select(Supplier).where(Supplier.user_id == current_user.id)
-        )
-        supplier = supplier_result.scalar_one_or_none()
-        if supplier:
-            query = query.where(ChatRoom.supplier_id == supplier.id)
-    elif current_user.role.value == "shop":
-        shop_result = await db.execute(
-            select(Shop).where(Shop.user_id == current_user.id)
+    unread = _unread_messages(current_user.id, room_filter).subquery()
+    result = await db.execute(select(func.count()).select_from(unread))
+    return {"count": result.scalar()}
+
+@router.get("/search", response_model=ChatSearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description='Words, "phrase", OR, -exclude'),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Search the current user's conversations, best matches first.
+    
+    Each result has the room and message ids to jump to (GET
+    /chat/rooms/{room_id}/messages?before_id=...) and a snippet with the
+    matches wrapped in <mark></mark> (the rest is HTML-escaped).
+    """
+    room_filter = await _room_filter(db, current_user)
+    if room_filter is None:
+        return {"items": [], "next_cursor": None}
+    
+    query = search_query(q)
+    rank = func.ts_rank(search_vector(ChatMessage.message), query).label("rank")
+    matches = (
+        select(
+            ChatMessage.id, ChatMessage.chat_room_id, ChatMessage.sender_id,
+            ChatMessage.message, ChatMessage.created_at, rank
         )
-        shop = shop_result.scalar_one_or_none()
-        if shop:
-            query = query.where(ChatRoom.shop_id == shop.id)
+        .join(ChatRoom, ChatRoom.id == ChatMessage.chat_room_id)
+        .where(room_filter, search_vector(ChatMessage.message).op("@@")(query))
+    )
+    if cursor is not None:
+        position = parse_cursor(cursor)
+        if position is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        matches = matches.where(tuple_(rank, ChatMessage.id) < tuple_(*position))
+    page = matches.order_by(rank.desc(), ChatMessage.id.desc()).limit(limit + 1).subquery()
     
-    result = await db.execute(query.options(selectinload(ChatRoom.messages)))
-    rooms = result.scalars().all()
+    # Snippets only for the returned page: ts_headline re-parses the whole message
+    result = await db.execute(
+        select(page, headline(page.c.message, query).label("snippet"))
+        .order_by(page.c.rank.desc(), page.c.id.desc())
+    )
+    rows = result.all()
     
-    total = 0
-    for room in rooms:
-        total += sum(1 for m in room.messages if not m.is_read and m.sender_id != current_user.id)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = format_cursor(rows[-1].rank, rows[-1].id)
     
-    return {"count": total}
+    return {
+        "items": [
+            {
+                "message_id": row.id,
+                "chat_room_id": row.chat_room_id,
+                "sender_id": row.sender_id,
+                "snippet": snippet_html(row.snippet),
+                "rank": row.rank,
+                "created_at": row.created_at,
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor
+    }
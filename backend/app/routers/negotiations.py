@@ -1,15 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List
+from typing import List, Optional
 
 from app.database import get_db
 from app.models import User, Supplier, Shop, Negotiation
 from app.schemas import NegotiationCreate, NegotiationResponse
 from app.auth import get_current_user
+from app.events import bus, negotiation_channel
 
 router = APIRouter()
 
+MAX_WAIT_SECONDS = 60
+
+
+async def _fetch_negotiations(
+    db: AsyncSession,
+    rfq_id: int,
+    after_id: Optional[int],
+    before_id: Optional[int],
+    limit: Optional[int]
+) -> List[Negotiation]:
+    """Fetch a slice of the thread, always returned oldest first"""
+    query = select(Negotiation).where(Negotiation.rfq_id == rfq_id)
+    
+    if before_id is not None or (after_id is None and limit):
+        # Backward pagination: newest rows older than the cursor (or the latest page)
+        if before_id is not None:
+            query = query.where(Negotiation.id < before_id)
+        query = query.order_by(Negotiation.id.desc())
+        if limit:
+            query = query.limit(limit)
+        result = await db.execute(query)
+        return list(reversed(result.scalars().all()))
+    
+    if after_id is not None:
+        query = query.where(Negotiation.id > after_id)
+    query = query.order_by(Negotiation.id.asc())
+    if limit:
+        query = query.limit(limit)
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
 @router.post("/", response_model=NegotiationResponse)
 async def create_negotiation(
     data: NegotiationCreate,
@@ -44,18 +76,39 @@ async def create_negotiation(
     db.add(negotiation)
     await db.commit()
     await db.refresh(negotiation)
+    
+    bus.publish(negotiation_channel(negotiation.rfq_id), {"id": negotiation.id})
     return negotiation
 
 @router.get("/{rfq_id}", response_model=List[NegotiationResponse])
 async def get_negotiations(
     rfq_id: int,
+    after_id: Optional[int] = Query(None, description="Only messages newer than this id"),
+    before_id: Optional[int] = Query(None, description="Only messages older than this id (scroll back)"),
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    wait: int = Query(0, ge=0, le=MAX_WAIT_SECONDS, description="Long-poll seconds when after_id has no new messages"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all negotiations for an RFQ"""
-    result = await db.execute(
-        select(Negotiation)
-        .where(Negotiation.rfq_id == rfq_id)
-        .order_by(Negotiation.created_at.asc())
-    )
-    return result.scalars().all()
+    """
+    Get negotiations for an RFQ.
+    
+    - no cursor: whole thread (or the latest `limit` messages)
+    - `after_id`: incremental fetch, optionally long-polling for `wait` seconds
+    - `before_id`: backward pagination
+    """
+    if after_id is None or before_id is not None or wait == 0:
+        return await _fetch_negotiations(db, rfq_id, after_id, before_id, limit)
+    
+    # Subscribe before querying so a message committed in between is not missed
+    async with bus.subscribe(negotiation_channel(rfq_id)) as sub:
+        negotiations = await _fetch_negotiations(db, rfq_id, after_id, None, limit)
+        if negotiations:
+            return negotiations
+        
+        # Release the pooled connection while the request is parked
+        await db.commit()
+        if await sub.get(timeout=wait) is None:
+            return []
+    
+    return await _fetch_negotiations(db, rfq_id, after_id, None, limit)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, func, and_
+from sqlalchemy import select, update, func, and_, event
+from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import Optional, List
 from enum import Enum
@@ -8,9 +9,13 @@ from enum import Enum
 from app.database import get_db
 from app.models import User, Notification, NotificationType
 from app.auth import get_current_user
+from app.events import bus, notification_channel
 
 router = APIRouter()
 
+# Session.info key holding notifications queued by create_notification
+OUTBOX_KEY = "notification_outbox"
+
 
 # ==================== GET NOTIFICATIONS ====================
 
@@ -135,21 +140,24 @@ async def delete_notification(
 
 # ==================== HELPER FUNCTION ====================
 
-async def create_notification(
+def create_notification(
     db: AsyncSession,
     user_id: int,
     notification_type: str,
     title: str,
     message: str = "",
-    link: str = None,
-    data: dict = None
-):
+    link: str = None
+) -> Notification:
     """
-    Helper function to create a new notification.
+    Helper function to queue a new notification.
     Call this from other routers when events happen.
     
+    The notification is added to the caller's session and inserted by the
+    caller's own commit, so it is saved atomically with the change that
+    triggered it. Live listeners are notified after that commit.
+    
     Example:
-        await create_notification(
+        create_notification(
             db=db,
             user_id=supplier.user_id,
             notification_type="rfq_received",
@@ -157,35 +165,45 @@ async def create_notification(
             message="Shop ABC has sent you a new RFQ",
             link="/supplier/rfq"
         )
+        await db.commit()
     """
+    # Convert string to enum if needed
     try:
-        # Convert string to enum if needed
-        try:
-            ntype = NotificationType(notification_type)
-        except (ValueError, KeyError):
-            ntype = notification_type  # Use as string if not in enum
-        
-        notification = Notification(
-            user_id=user_id,
-            type=ntype,
-            title=title,
-            message=message,
-            is_read=False,
-            created_at=datetime.utcnow()
-        )
-        
-        # Add optional fields if model supports them
-        if hasattr(notification, 'link') and link:
-            notification.link = link
-        if hasattr(notification, 'data') and data:
-            notification.data = data
-        
-        db.add(notification)
-        await db.commit()
-        await db.refresh(notification)
-        
-        return notification
-    except Exception as e:
-        print(f"Error creating notification: {e}")
-        await db.rollback()
-        return None
\ No newline at end of file
+        ntype = NotificationType(notification_type)
+    except (ValueError, KeyError):
+        ntype = NotificationType.SYSTEM
+    
+    notification = Notification(
+        user_id=user_id,
+        type=ntype,
+        title=title,
+        message=message,
+        link=link,
+        is_read=False
+    )
+    db.add(notification)
+    db.info.setdefault(OUTBOX_KEY, []).append(notification)
+    return notification
+
+
+# ==================== OUTBOX DISPATCHER ====================
+
+def publish_notifications(rows):
+    """Push (notification_id, user_id) pairs to live listeners"""
+    by_user = {}
+    for notification_id, user_id in rows:
+        by_user.setdefault(user_id, []).append(notification_id)
+    for user_id, ids in by_user.items():
+        bus.publish(notification_channel(user_id), {"ids": ids})
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_outbox(session):
+    outbox = session.info.pop(OUTBOX_KEY, None)
+    if outbox:
+        publish_notifications((n.id, n.user_id) for n in outbox)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_outbox(session):
+    session.info.pop(OUTBOX_KEY, None)
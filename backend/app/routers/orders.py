@@ -1,29 +1,161 @@
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query  # <-- Thêm Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Response  # <-- Thêm Query
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, insert, func, tuple_, values, column, literal, Integer
 from sqlalchemy.orm import selectinload
-from datetime import datetime
+from datetime import datetime, date, timedelta
 from pathlib import Path
+from typing import List, Optional
 
-from app.database import get_db
+from app.database import get_db, AsyncSessionLocal
 from app.models import (
-    User, Supplier, Shop, Contract, ContractStatus, 
-    Order, OrderStatus, PaymentMethod, SupplierPaymentInfo
+    User, Supplier, Shop, Contract, ContractStatus, Product,
+    Order, OrderStatus, OrderTracking, OrderItem, PaymentMethod, SupplierPaymentInfo, ORDER_TRANSITIONS,
+    order_code_seq
+)
+from app.schemas import (
+    OrderCreate, OrderMultiCreate, OrderResponse, OrderWithItems, OrderListItem, OrderTrackingResponse,
+    OrderBulkStatusUpdate, OrderBulkStatusResult,
+    PaymentInfoCreate
 )
-from app.schemas import OrderCreate, OrderResponse, OrderWithDetails, PaymentInfoCreate, PaymentInfoResponse
 from app.auth import get_current_user, get_supplier_user, get_shop_user
+from app.analytics import record_orders
+from app.inventory import reserve_stock, reserve_stock_bulk, release_stock
+from app.routers.notifications import create_notification
+from app.exports import stream_csv, stream_xlsx
 
 router = APIRouter()
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Built once at import, reused for every GET /orders response
+ORDER_LIST_ADAPTER = TypeAdapter(List[OrderListItem])
+ORDER_PAGE_SIZE = 100  # Page size when only a cursor is given
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_HEADER = (
+    "Order code", "Created at", "Status", "Payment method", "Shop", "Supplier", "Product",
+    "Quantity", "Unit price", "Total amount", "Paid at", "Shipping address", "Note",
+)
+
+
+async def generate_order_codes(db: AsyncSession, count: int = 1) -> List[str]:
+    """ORD-YYYYMMDD-NNNNNN codes numbered from order_code_seq (unique, no retries)"""
+    result = await db.execute(
+        select(order_code_seq.next_value()).select_from(func.generate_series(1, count))
+    )
+    today = datetime.now().strftime('%Y%m%d')
+    return [f"ORD-{today}-{number:06d}" for number in result.scalars().all()]
+
+
+async def _order_filters(
+    db: AsyncSession,
+    current_user: User,
+    status: Optional[OrderStatus],
+    date_from: Optional[date],
+    date_to: Optional[date]
+) -> list:
+    """WHERE clauses shared by the order list and export: owner + optional filters"""
+    filters = []
+    if current_user.role.value == "supplier":
+        result = await db.execute(select(Supplier.id).where(Supplier.user_id == current_user.id))
+        supplier_id = result.scalar_one_or_none()
+        if supplier_id:
+            filters.append(Order.supplier_id == supplier_id)
+    elif current_user.role.value == "shop":
+        result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+        shop_id = result.scalar_one_or_none()
+        if shop_id:
+            filters.append(Order.shop_id == shop_id)
+    
+    if status is not None:
+        filters.append(Order.status == status)
+    if date_from is not None:
+        filters.append(Order.created_at >= date_from)
+    if date_to is not None:
+        filters.append(Order.created_at < date_to + timedelta(days=1))
+    return filters
+
+
+def add_tracking(db: AsyncSession, order_id: int, status: OrderStatus, user_id: int, note: str = None):
+    """Append a timeline event; saved by the caller's commit together with the status change"""
+    db.add(OrderTracking(order_id=order_id, status=status, note=note, updated_by=user_id))
+
+
+async def _get_order_state(db: AsyncSession, order_id: int):
+    """Load only the columns needed to authorize and validate a status change"""
+    result = await db.execute(
+        select(
+            Order.id, Order.order_code, Order.supplier_id, Order.shop_id,
+            Order.status, Order.version
+        ).where(Order.id == order_id)
+    )
+    order = result.one_or_none()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+
+def _check_transition(current: OrderStatus, new: OrderStatus):
+    if new not in ORDER_TRANSITIONS.get(current, set()):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Không thể chuyển trạng thái từ {current.value} sang {new.value}"
+        )
+
+
+async def transition_order(
+    db: AsyncSession,
+    order,
+    status: OrderStatus,
+    user_id: int,
+    note: str = None,
+    expected_version: Optional[int] = None,
+    **values
+) -> int:
+    """
+    Move an order to a new status with a conditional UPDATE on its version.
+    `order` is a row from _get_order_state. Returns the new version; raises
+    409 if the order changed since it was read. The caller commits.
+    """
+    version = order.version if expected_version is None else expected_version
+    if version != order.version:
+        raise HTTPException(status_code=409, detail="Order was modified by another request")
+    _check_transition(order.status, status)
+    
+    if status == OrderStatus.PAID:
+        values["paid_at"] = func.now()
+    result = await db.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.version == version)
+        .values(status=status, version=Order.version + 1, updated_at=func.now(), **values)
+        .returning(Order.version)
+    )
+    new_version = result.scalar_one_or_none()
+    if new_version is None:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Order was modified by another request")
+    
+    add_tracking(db, order.id, status, user_id, note)
+    if status == OrderStatus.CANCELLED:
+        await record_orders(db, [order.id], sign=-1)
+        await release_stock(db, [order.id])
+    return new_version
+
 
-def generate_order_code():
-    now = datetime.now()
-    random_part = uuid.uuid4().hex[:4].upper()
-    return f"ORD-{now.strftime('%Y%m%d')}-{random_part}"
+async def _check_order_access(db: AsyncSession, current_user: User, supplier_id: int, shop_id: int):
+    """Raise 403 unless the user is the order's supplier, its shop or an admin"""
+    if current_user.role.value == "supplier":
+        result = await db.execute(select(Supplier.id).where(Supplier.user_id == current_user.id))
+        if result.scalar_one_or_none() != supplier_id:
+            raise HTTPException(status_code=403, detail="Access denied")
+    elif current_user.role.value == "shop":
+        result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+        if result.scalar_one_or_none() != shop_id:
+            raise HTTPException(status_code=403, detail="Access denied")
 
 
 # ==================== PAYMENT INFO ENDPOINTS (PHẢI ĐẶT TRƯỚC /{order_id}) ====================
@@ -211,79 +343,111 @@ async def get_supplier_payment_info(
 
 # ==================== ORDER ENDPOINTS (SAU PAYMENT INFO) ====================
 
+def _order_list_item(row) -> dict:
+    """Nest one flat projection row into the GET /orders item shape"""
+    return {
+        "id": row.id,
+        "order_code": row.order_code,
+        "contract_id": row.contract_id,
+        "supplier_id": row.supplier_id,
+        "shop_id": row.shop_id,
+        "quantity": row.quantity,
+        "unit_price": row.unit_price or 0,
+        "total_amount": row.total_amount or 0,
+        "shipping_address": row.shipping_address,
+        "note": row.note,
+        "status": row.status or OrderStatus.PENDING,
+        "payment_method": row.payment_method or PaymentMethod.BANK_TRANSFER,
+        "payment_proof": row.payment_proof,
+        "paid_at": row.paid_at,
+        "version": row.version,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+        "contract": {
+            "id": row.contract_id,
+            "agreed_price": row.agreed_price or 0,
+            "status": row.contract_status,
+            "product": {
+                "id": row.product_id,
+                "name": row.product_name,
+                "image_url": row.product_image_url,
+            } if row.product_id is not None else None
+        } if row.agreed_price is not None else None,
+        "supplier": {
+            "id": row.supplier_id,
+            "company_name": row.company_name,
+            "phone": row.supplier_phone,
+            "address": row.supplier_address,
+        },
+        "shop": {
+            "id": row.shop_id,
+            "shop_name": row.shop_name,
+            "phone": row.shop_phone,
+            "address": row.shop_address,
+        },
+    }
+
+
 @router.get("/")
 async def get_orders(
+    status: Optional[OrderStatus] = Query(None),
+    date_from: Optional[date] = Query(None, description="Created on or after this day"),
+    date_to: Optional[date] = Query(None, description="Created on or before this day"),
+    cursor: Optional[int] = Query(None, description="Value of X-Next-Cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; without limit and cursor every order is returned"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all orders for current user"""
-    query = select(Order).options(
-        selectinload(Order.contract).selectinload(Contract.product),
-        selectinload(Order.supplier),
-        selectinload(Order.shop)
+    """
+    Get orders for current user, newest first.
+    
+    Selects only the returned columns (no ORM objects). With limit or cursor
+    it pages with a keyset cursor, the next page's cursor is returned in the
+    X-Next-Cursor header; without them the whole list is returned as before.
+    """
+    query = (
+        select(
+            Order.id, Order.order_code, Order.contract_id, Order.supplier_id, Order.shop_id,
+            Order.quantity, Order.unit_price, Order.total_amount, Order.shipping_address, Order.note,
+            Order.status, Order.payment_method, Order.payment_proof, Order.paid_at, Order.version,
+            Order.created_at, Order.updated_at,
+            Contract.agreed_price, Contract.status.label("contract_status"),
+            Product.id.label("product_id"), Product.name.label("product_name"),
+            Product.image_url.label("product_image_url"),
+            Supplier.company_name, Supplier.phone.label("supplier_phone"),
+            Supplier.address.label("supplier_address"),
+            Shop.shop_name, Shop.phone.label("shop_phone"), Shop.address.label("shop_address"),
+        )
+        .outerjoin(Contract, Contract.id == Order.contract_id)
+        .outerjoin(Product, Product.id == Contract.product_id)
+        .outerjoin(Supplier, Supplier.id == Order.supplier_id)
+        .outerjoin(Shop, Shop.id == Order.shop_id)
     )
     
-    if current_user.role.value == "supplier":
-        result = await db.execute(select(Supplier).where(Supplier.user_id == current_user.id))
-        supplier = result.scalar_one_or_none()
-        if supplier:
-            query = query.where(Order.supplier_id == supplier.id)
-    elif current_user.role.value == "shop":
-        result = await db.execute(select(Shop).where(Shop.user_id == current_user.id))
-        shop = result.scalar_one_or_none()
-        if shop:
-            query = query.where(Order.shop_id == shop.id)
+    query = query.where(*await _order_filters(db, current_user, status, date_from, date_to))
+    if cursor is not None:
+        query = query.where(Order.id < cursor)
     
-    query = query.order_by(Order.created_at.desc())
+    # ids grow with created_at, so id order is creation order and uses the PK / (owner, id) indexes
+    query = query.order_by(Order.id.desc())
+    if limit is None and cursor is not None:
+        limit = ORDER_PAGE_SIZE
+    if limit is not None:
+        query = query.limit(limit + 1)
     result = await db.execute(query)
-    orders = result.scalars().all()
-    
-    orders_data = []
-    for order in orders:
-        order_dict = {
-            "id": order.id,
-            "order_code": order.order_code,
-            "contract_id": order.contract_id,
-            "supplier_id": order.supplier_id,
-            "shop_id": order.shop_id,
-            "quantity": order.quantity,
-            "unit_price": float(order.unit_price) if order.unit_price else 0,
-            "total_amount": float(order.total_amount) if order.total_amount else 0,
-            "shipping_address": order.shipping_address,
-            "note": order.note,
-            "status": order.status.value if order.status else "pending",
-            "payment_method": order.payment_method.value if order.payment_method else "bank_transfer",
-            "payment_proof": order.payment_proof,
-            "paid_at": order.paid_at.isoformat() if order.paid_at else None,
-            "created_at": order.created_at.isoformat() if order.created_at else None,
-            "updated_at": order.updated_at.isoformat() if order.updated_at else None,
-            "contract": {
-                "id": order.contract.id,
-                "contract_code": getattr(order.contract, 'contract_code', None),
-                "agreed_price": float(order.contract.agreed_price) if order.contract.agreed_price else 0,
-                "status": order.contract.status.value if order.contract.status else None,
-                "product": {
-                    "id": order.contract.product.id,
-                    "name": order.contract.product.name,
-                    "image_url": order.contract.product.image_url,
-                } if order.contract.product else None
-            } if order.contract else None,
-            "supplier": {
-                "id": order.supplier.id,
-                "company_name": order.supplier.company_name,
-                "phone": order.supplier.phone,
-                "address": order.supplier.address,
-            } if order.supplier else None,
-            "shop": {
-                "id": order.shop.id,
-                "shop_name": order.shop.shop_name,
-                "phone": order.shop.phone,
-                "address": order.shop.address,
-            } if order.shop else None,
-        }
-        orders_data.append(order_dict)
-    
-    return orders_data
+    rows = result.all()
+    
+    headers = {}
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = str(rows[-1].id)
+    
+    items = ORDER_LIST_ADAPTER.validate_python([_order_list_item(row) for row in rows])
+    return Response(
+        content=ORDER_LIST_ADAPTER.dump_json(items),
+        media_type="application/json",
+        headers=headers
+    )
 
 
 @router.post("/", response_model=OrderResponse)
@@ -311,8 +475,12 @@ async def create_order(
     if contract.status != ContractStatus.ACTIVE:
         raise HTTPException(status_code=400, detail="Contract is not active")
     
+    # Conditional UPDATE, rolled back with the order if anything below fails
+    await reserve_stock(db, contract.product_id, data.quantity)
+    
+    order_code, = await generate_order_codes(db)
     order = Order(
-        order_code=generate_order_code(),
+        order_code=order_code,
         contract_id=contract.id,
         supplier_id=contract.supplier_id,
         shop_id=shop.id,
@@ -323,15 +491,279 @@ async def create_order(
         note=data.note,
         status=OrderStatus.PENDING,
         payment_method=data.payment_method or PaymentMethod.BANK_TRANSFER,
+        stock_reserved=True,
     )
     
     db.add(order)
+    await db.flush()
+    add_tracking(db, order.id, OrderStatus.PENDING, current_user.id)
+    await record_orders(db, [order.id])
     await db.commit()
     await db.refresh(order)
     
     return order
 
 
+@router.post("/multi", response_model=OrderWithItems)
+async def create_multi_line_order(
+    data: OrderMultiCreate,
+    current_user: User = Depends(get_shop_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Create one order with several lines, each from a contract with the same supplier (Shop only)"""
+    result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+    shop_id = result.scalar_one_or_none()
+    if not shop_id:
+        raise HTTPException(status_code=404, detail="Shop not found")
+    
+    # Repeated contracts are merged into one line
+    quantities = {}
+    for line in data.lines:
+        quantities[line.contract_id] = quantities.get(line.contract_id, 0) + line.quantity
+    
+    # All contracts checked in one query
+    result = await db.execute(
+        select(
+            Contract.id, Contract.supplier_id, Contract.shop_id, Contract.product_id,
+            Contract.status, Supplier.user_id.label("supplier_user_id")
+        )
+        .join(Supplier, Supplier.id == Contract.supplier_id)
+        .where(Contract.id.in_(quantities))
+    )
+    contracts = {row.id: row for row in result.all()}
+    missing = [contract_id for contract_id in quantities if contract_id not in contracts]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Contract not found: {missing}")
+    if any(row.shop_id != shop_id for row in contracts.values()):
+        raise HTTPException(status_code=403, detail="Contract does not belong to you")
+    if any(row.status != ContractStatus.ACTIVE for row in contracts.values()):
+        raise HTTPException(status_code=400, detail="Contract is not active")
+    supplier_ids = {row.supplier_id for row in contracts.values()}
+    if len(supplier_ids) > 1:
+        raise HTTPException(status_code=400, detail="Tất cả sản phẩm trong đơn phải cùng một nhà cung cấp")
+    first = contracts[next(iter(quantities))]
+    
+    wanted = {}
+    for contract_id, quantity in quantities.items():
+        product_id = contracts[contract_id].product_id
+        wanted[product_id] = wanted.get(product_id, 0) + quantity
+    if len(await reserve_stock_bulk(db, wanted)) < len(wanted):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Không đủ hàng trong kho")
+    
+    order_code, = await generate_order_codes(db)
+    order = Order(
+        order_code=order_code,
+        contract_id=first.id,
+        supplier_id=first.supplier_id,
+        shop_id=shop_id,
+        quantity=0,
+        unit_price=0,
+        total_amount=0,
+        shipping_address=data.shipping_address,
+        note=data.note,
+        status=OrderStatus.PENDING,
+        payment_method=data.payment_method or PaymentMethod.BANK_TRANSFER,
+        stock_reserved=True,
+    )
+    db.add(order)
+    await db.flush()
+    
+    # Items priced from their contracts in a single INSERT ... SELECT
+    lines = values(
+        column("contract_id", Integer), column("quantity", Integer), name="lines"
+    ).data(list(quantities.items()))
+    await db.execute(
+        insert(OrderItem).from_select(
+            ["order_id", "contract_id", "product_id", "quantity", "unit_price", "total_amount"],
+            select(
+                literal(order.id), Contract.id, Contract.product_id, lines.c.quantity,
+                Contract.agreed_price, Contract.agreed_price * lines.c.quantity
+            ).join(Contract, Contract.id == lines.c.contract_id)
+        )
+    )
+    
+    # Order totals summed by the database from the items
+    totals = (
+        select(
+            OrderItem.order_id,
+            func.sum(OrderItem.quantity).label("quantity"),
+            func.sum(OrderItem.total_amount).label("total_amount")
+        )
+        .where(OrderItem.order_id == order.id)
+        .group_by(OrderItem.order_id)
+        .subquery()
+    )
+    await db.execute(
+        update(Order)
+        .where(Order.id == totals.c.order_id)
+        .values(
+            quantity=totals.c.quantity,
+            total_amount=totals.c.total_amount,
+            unit_price=func.round(totals.c.total_amount / totals.c.quantity, 2)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    
+    add_tracking(db, order.id, OrderStatus.PENDING, current_user.id)
+    await record_orders(db, [order.id])
+    
+    # One notification per party, not per line
+    create_notification(
+        db=db,
+        user_id=first.supplier_user_id,
+        notification_type="order_created",
+        title="Đơn hàng mới",
+        message=f"Đơn hàng {order_code} gồm {len(quantities)} sản phẩm",
+        link="/supplier/orders"
+    )
+    create_notification(
+        db=db,
+        user_id=current_user.id,
+        notification_type="order_created",
+        title="Đã tạo đơn hàng",
+        message=f"Đơn hàng {order_code} gồm {len(quantities)} sản phẩm",
+        link="/shop/orders"
+    )
+    await db.commit()
+    
+    result = await db.execute(
+        select(Order).options(selectinload(Order.items)).where(Order.id == order.id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalar_one()
+
+
+@router.post("/bulk-status", response_model=List[OrderBulkStatusResult])
+async def bulk_update_order_status(
+    data: OrderBulkStatusUpdate,
+    current_user: User = Depends(get_supplier_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Move many of the supplier's orders to one status (Supplier only), with per-order results"""
+    result = await db.execute(select(Supplier.id).where(Supplier.user_id == current_user.id))
+    supplier_id = result.scalar_one_or_none()
+    if not supplier_id:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    
+    order_ids = list(dict.fromkeys(data.order_ids))
+    results = {}
+    
+    # Ownership and transition checks for all orders in one query
+    result = await db.execute(
+        select(Order.id, Order.status, Order.version)
+        .where(Order.id.in_(order_ids), Order.supplier_id == supplier_id)
+    )
+    current = {row.id: row for row in result.all()}
+    
+    expected = []
+    for order_id in order_ids:
+        row = current.get(order_id)
+        if row is None:
+            results[order_id] = OrderBulkStatusResult(order_id=order_id, ok=False, error="Order not found")
+        elif data.status not in ORDER_TRANSITIONS.get(row.status, set()):
+            results[order_id] = OrderBulkStatusResult(
+                order_id=order_id, ok=False, status=row.status, version=row.version,
+                error=f"Không thể chuyển trạng thái từ {row.status.value} sang {data.status.value}"
+            )
+        else:
+            expected.append((row.id, row.version))
+    
+    if expected:
+        values = {"status": data.status, "version": Order.version + 1, "updated_at": func.now()}
+        if data.status == OrderStatus.PAID:
+            values["paid_at"] = func.now()
+        
+        # Single set-based UPDATE; rows changed since the read keep their version and are skipped
+        result = await db.execute(
+            update(Order)
+            .where(tuple_(Order.id, Order.version).in_(expected))
+            .values(**values)
+            .returning(Order.id, Order.version)
+            .execution_options(synchronize_session=False)
+        )
+        updated = dict(result.all())
+        
+        if updated:
+            await db.execute(
+                insert(OrderTracking),
+                [
+                    {"order_id": order_id, "status": data.status, "note": data.note, "updated_by": current_user.id}
+                    for order_id in updated
+                ]
+            )
+            if data.status == OrderStatus.CANCELLED:
+                await record_orders(db, list(updated), sign=-1)
+                await release_stock(db, list(updated))
+        
+        for order_id, _ in expected:
+            if order_id in updated:
+                results[order_id] = OrderBulkStatusResult(
+                    order_id=order_id, ok=True, status=data.status, version=updated[order_id]
+                )
+            else:
+                results[order_id] = OrderBulkStatusResult(
+                    order_id=order_id, ok=False, error="Order was modified by another request"
+                )
+    
+    await db.commit()
+    return [results[order_id] for order_id in order_ids]
+
+
+@router.get("/export")
+async def export_orders(
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    status: Optional[OrderStatus] = Query(None),
+    date_from: Optional[date] = Query(None, description="Created on or after this day"),
+    date_to: Optional[date] = Query(None, description="Created on or before this day"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download orders as CSV or XLSX, with the same filters as GET /orders.
+    
+    Rows are fetched with a server-side cursor and written out as they arrive,
+    so the whole export is never held in memory.
+    """
+    query = (
+        select(
+            Order.order_code, Order.created_at, Order.status, Order.payment_method,
+            Shop.shop_name, Supplier.company_name, Product.name,
+            Order.quantity, Order.unit_price, Order.total_amount, Order.paid_at,
+            Order.shipping_address, Order.note,
+        )
+        .outerjoin(Contract, Contract.id == Order.contract_id)
+        .outerjoin(Product, Product.id == Contract.product_id)
+        .outerjoin(Supplier, Supplier.id == Order.supplier_id)
+        .outerjoin(Shop, Shop.id == Order.shop_id)
+        .where(*await _order_filters(db, current_user, status, date_from, date_to))
+        .order_by(Order.id.desc())
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    
+    async def rows():
+        # The request session is closed before the body is sent, use a dedicated one
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(query)
+            async for partition in result.partitions():
+                for row in partition:
+                    yield tuple(row)
+    
+    filename = f"orders-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+    if format == "xlsx":
+        body = stream_xlsx(EXPORT_HEADER, rows(), sheet_name="Orders")
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        body = stream_csv(EXPORT_HEADER, rows())
+        media_type = "text/csv"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @router.get("/{order_id}")
 async def get_order(
     order_id: int,
@@ -344,7 +776,8 @@ async def get_order(
         .options(
             selectinload(Order.contract).selectinload(Contract.product),
             selectinload(Order.supplier),
-            selectinload(Order.shop)
+            selectinload(Order.shop),
+            selectinload(Order.items).selectinload(OrderItem.product)
         )
         .where(Order.id == order_id)
     )
@@ -368,6 +801,7 @@ async def get_order(
         "payment_method": order.payment_method.value if order.payment_method else "bank_transfer",
         "payment_proof": order.payment_proof,
         "paid_at": order.paid_at.isoformat() if order.paid_at else None,
+        "version": order.version,
         "created_at": order.created_at.isoformat() if order.created_at else None,
         "updated_at": order.updated_at.isoformat() if order.updated_at else None,
         "contract": {
@@ -393,57 +827,79 @@ async def get_order(
             "phone": order.shop.phone,
             "address": order.shop.address,
         } if order.shop else None,
+        "items": [
+            {
+                "id": item.id,
+                "contract_id": item.contract_id,
+                "product_id": item.product_id,
+                "product_name": item.product.name if item.product else None,
+                "quantity": item.quantity,
+                "unit_price": float(item.unit_price),
+                "total_amount": float(item.total_amount),
+            }
+            for item in order.items
+        ],
     }
 
 
-@router.patch("/{order_id}/status")
-async def update_order_status(
+@router.get("/{order_id}/timeline", response_model=List[OrderTrackingResponse])
+async def get_order_timeline(
     order_id: int,
-    new_status: str = Query(...),  # <-- Nhận từ query param
+    after_id: Optional[int] = Query(None, description="Only events after this one (id of the last event seen)"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Update order status"""
+    """
+    Get the order's status history, oldest first (poll with ?after_id= for new events).
+    
+    Events of one order are written after the conditional UPDATE on its row,
+    so they commit in id order; created_at (transaction start) does not, and
+    a timestamp cursor could skip an event from a long transaction.
+    """
     result = await db.execute(
-        select(Order).where(Order.id == order_id)
+        select(Order.supplier_id, Order.shop_id).where(Order.id == order_id)
     )
-    order = result.scalar_one_or_none()
-    
-    if not order:
+    owners = result.one_or_none()
+    if not owners:
         raise HTTPException(status_code=404, detail="Order not found")
+    await _check_order_access(db, current_user, owners.supplier_id, owners.shop_id)
+    
+    query = select(OrderTracking).where(OrderTracking.order_id == order_id)
+    if after_id is not None:
+        query = query.where(OrderTracking.id > after_id)
+    result = await db.execute(query.order_by(OrderTracking.id.asc()))
+    return result.scalars().all()
+
+
+@router.patch("/{order_id}/status")
+async def update_order_status(
+    order_id: int,
+    new_status: str = Query(...),  # <-- Nhận từ query param
+    note: Optional[str] = Query(None),
+    expected_version: Optional[int] = Query(None, description="Order version the client last saw"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Update order status (validated against ORDER_TRANSITIONS, 409 on concurrent change)"""
+    order = await _get_order_state(db, order_id)
     
     # Check permission
-    if current_user.role.value == "supplier":
-        supplier_result = await db.execute(
-            select(Supplier).where(Supplier.user_id == current_user.id)
-        )
-        supplier = supplier_result.scalar_one_or_none()
-        if not supplier or order.supplier_id != supplier.id:
-            raise HTTPException(status_code=403, detail="Access denied")
-    elif current_user.role.value == "shop":
-        shop_result = await db.execute(
-            select(Shop).where(Shop.user_id == current_user.id)
-        )
-        shop = shop_result.scalar_one_or_none()
-        if not shop or order.shop_id != shop.id:
-            raise HTTPException(status_code=403, detail="Access denied")
+    await _check_order_access(db, current_user, order.supplier_id, order.shop_id)
     
     # Convert string to enum
     try:
         status = OrderStatus(new_status)
     except ValueError:
-        raise HTTPException(status_code=400, detail=f"Invalid status: {new_status}. Valid: pending, confirmed, processing, shipped, delivered, cancelled, paid")
-    
-    order.status = status
-    order.updated_at = datetime.utcnow()
-    
-    if status == OrderStatus.PAID:
-        order.paid_at = datetime.utcnow()
+        valid = ", ".join(s.value for s in OrderStatus)
+        raise HTTPException(status_code=400, detail=f"Invalid status: {new_status}. Valid: {valid}")
     
+    version = await transition_order(
+        db, order, status, current_user.id,
+        note=note, expected_version=expected_version
+    )
     await db.commit()
-    await db.refresh(order)
     
-    return {"message": "Order status updated", "status": order.status.value}
+    return {"message": "Order status updated", "status": status.value, "version": version}
 
 
 @router.post("/{order_id}/payment-proof")
@@ -454,11 +910,9 @@ async def upload_payment_proof(
     db: AsyncSession = Depends(get_db)
 ):
     """Upload payment proof (Shop only)"""
-    result = await db.execute(select(Order).where(Order.id == order_id))
-    order = result.scalar_one_or_none()
-    
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
+    order = await _get_order_state(db, order_id)
+    await _check_order_access(db, current_user, order.supplier_id, order.shop_id)
+    _check_transition(order.status, OrderStatus.PAID)
     
     file_ext = file.filename.split(".")[-1] if file.filename else "png"
     filename = f"payment_{order.order_code}_{uuid.uuid4().hex[:8]}.{file_ext}"
@@ -469,10 +923,11 @@ async def upload_payment_proof(
     with open(file_path, "wb") as f:
         f.write(content)
     
-    order.payment_proof = f"/uploads/payments/{filename}"
-    order.status = OrderStatus.PAID
-    order.paid_at = datetime.utcnow()
-    
+    payment_proof = f"/uploads/payments/{filename}"
+    await transition_order(
+        db, order, OrderStatus.PAID, current_user.id,
+        note="Payment proof uploaded", payment_proof=payment_proof
+    )
     await db.commit()
     
-    return {"message": "Payment proof uploaded", "url": order.payment_proof}
\ No newline at end of file
+    return {"message": "Payment proof uploaded", "url": payment_proof}
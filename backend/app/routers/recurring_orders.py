@@ -0,0 +1,101 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from datetime import date
+from typing import List
+
+from app.database import get_db
+from app.models import User, Supplier, Shop, Contract, ContractStatus, RecurringOrderSchedule, PaymentMethod
+from app.schemas import RecurringOrderScheduleCreate, RecurringOrderScheduleResponse
+from app.auth import get_current_user, get_shop_user
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[RecurringOrderScheduleResponse])
+async def list_schedules(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """List recurring order schedules (shop: its own, supplier: on its contracts)"""
+    query = select(RecurringOrderSchedule)
+
+    if current_user.role.value == "supplier":
+        result = await db.execute(select(Supplier.id).where(Supplier.user_id == current_user.id))
+        supplier_id = result.scalar_one_or_none()
+        query = query.join(Contract, Contract.id == RecurringOrderSchedule.contract_id).where(
+            Contract.supplier_id == supplier_id
+        )
+    elif current_user.role.value == "shop":
+        result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+        query = query.where(RecurringOrderSchedule.shop_id == result.scalar_one_or_none())
+
+    result = await db.execute(query.order_by(RecurringOrderSchedule.id.desc()))
+    return result.scalars().all()
+
+
+@router.post("/", response_model=RecurringOrderScheduleResponse)
+async def create_schedule(
+    data: RecurringOrderScheduleCreate,
+    current_user: User = Depends(get_shop_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Order a fixed quantity from a contract every week or month (Shop only)"""
+    result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+    shop_id = result.scalar_one_or_none()
+    if not shop_id:
+        raise HTTPException(status_code=404, detail="Shop not found")
+
+    result = await db.execute(select(Contract).where(Contract.id == data.contract_id))
+    contract = result.scalar_one_or_none()
+    if not contract:
+        raise HTTPException(status_code=404, detail="Contract not found")
+    if contract.shop_id != shop_id:
+        raise HTTPException(status_code=403, detail="Contract does not belong to you")
+    if contract.status != ContractStatus.ACTIVE:
+        raise HTTPException(status_code=400, detail="Contract is not active")
+
+    start_date = data.start_date or date.today()
+    if start_date < date.today():
+        raise HTTPException(status_code=400, detail="Ngày bắt đầu không được ở quá khứ")
+    if contract.start_date and start_date < contract.start_date:
+        start_date = contract.start_date
+    if contract.end_date and start_date > contract.end_date:
+        raise HTTPException(status_code=400, detail="Ngày bắt đầu sau ngày kết thúc hợp đồng")
+
+    schedule = RecurringOrderSchedule(
+        contract_id=contract.id,
+        shop_id=shop_id,
+        quantity=data.quantity,
+        frequency=data.frequency,
+        next_run_date=start_date,
+        anchor_day=start_date.day,
+        shipping_address=data.shipping_address,
+        note=data.note,
+        payment_method=data.payment_method or PaymentMethod.BANK_TRANSFER,
+    )
+    db.add(schedule)
+    await db.commit()
+    await db.refresh(schedule)
+    return schedule
+
+
+@router.delete("/{schedule_id}")
+async def cancel_schedule(
+    schedule_id: int,
+    current_user: User = Depends(get_shop_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Stop a recurring order schedule (Shop only); orders already created are kept"""
+    result = await db.execute(
+        select(RecurringOrderSchedule)
+        .join(Shop, Shop.id == RecurringOrderSchedule.shop_id)
+        .where(RecurringOrderSchedule.id == schedule_id, Shop.user_id == current_user.id)
+    )
+    schedule = result.scalar_one_or_none()
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+
+    schedule.is_active = False
+    await db.commit()
+    return {"message": "Đã hủy lịch đặt hàng định kỳ"}
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, literal
 from sqlalchemy.orm import selectinload
 from typing import List
 
 from app.database import get_db
-from app.models import User, Supplier, RFQ, RFQStatus, Product
-from app.schemas import RFQResponse, RFQWithDetails
+from app.models import User, Supplier, Shop, RFQ, RFQStatus, Product, Quote
+from app.schemas import RFQResponse, RFQWithDetails, RankedQuote, RankedQuotePage
 from app.auth import get_current_user
 
 router = APIRouter()
@@ -67,6 +68,108 @@ async def get_rfq(
         raise HTTPException(status_code=404, detail="RFQ not found")
     return rfq
 
+@router.get("/{rfq_id}/quotes/ranked", response_model=RankedQuotePage)
+async def get_ranked_quotes(
+    rfq_id: int,
+    request: Request,
+    w_price: float = Query(0.5, ge=0, description="Weight of price in the score"),
+    w_lead_time: float = Query(0.3, ge=0, description="Weight of lead time in the score"),
+    w_min_order_qty: float = Query(0.2, ge=0, description="Weight of minimum order quantity in the score"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Rank the quotes of an RFQ by price, lead time and MOQ with a weighted score"""
+    total_weight = w_price + w_lead_time + w_min_order_qty
+    if total_weight <= 0:
+        raise HTTPException(status_code=400, detail="At least one weight must be positive")
+    
+    result = await db.execute(select(RFQ.shop_id).where(RFQ.id == rfq_id))
+    rfq_shop_id = result.scalar_one_or_none()
+    if rfq_shop_id is None:
+        raise HTTPException(status_code=404, detail="RFQ not found")
+    
+    # Only the shop that owns the RFQ (or admin) may compare competing quotes
+    if current_user.role.value != "admin":
+        result = await db.execute(select(Shop.id).where(Shop.user_id == current_user.id))
+        if result.scalar_one_or_none() != rfq_shop_id:
+            raise HTTPException(status_code=403, detail="Access denied")
+    
+    price_order = Quote.price.asc()
+    lead_time_order = Quote.lead_time.asc().nulls_last()
+    moq_order = Quote.min_order_qty.asc().nulls_last()
+    
+    # Window functions run over every quote of the RFQ before pagination
+    ranked = (
+        select(
+            Quote.id,
+            Quote.supplier_id,
+            Supplier.company_name,
+            Quote.price,
+            Quote.min_order_qty,
+            Quote.lead_time,
+            Quote.status,
+            Quote.created_at,
+            Product.price.label("list_price"),
+            func.rank().over(order_by=price_order).label("price_rank"),
+            func.rank().over(order_by=lead_time_order).label("lead_time_rank"),
+            func.rank().over(order_by=moq_order).label("min_order_qty_rank"),
+            func.percent_rank().over(order_by=price_order).label("price_pct"),
+            func.percent_rank().over(order_by=lead_time_order).label("lead_time_pct"),
+            func.percent_rank().over(order_by=moq_order).label("moq_pct"),
+            func.count().over().label("total"),
+        )
+        .join(RFQ, RFQ.id == Quote.rfq_id)
+        .join(Product, Product.id == RFQ.product_id)
+        .join(Supplier, Supplier.id == Quote.supplier_id)
+        .where(Quote.rfq_id == rfq_id)
+        .subquery()
+    )
+    
+    score = literal(1.0) - (
+        ranked.c.price_pct * w_price
+        + ranked.c.lead_time_pct * w_lead_time
+        + ranked.c.moq_pct * w_min_order_qty
+    ) / total_weight
+    price_delta = ranked.c.price - ranked.c.list_price
+    
+    result = await db.execute(
+        select(
+            ranked,
+            score.label("score"),
+            price_delta.label("price_delta"),
+            (price_delta * 100 / func.nullif(ranked.c.list_price, 0)).label("price_delta_pct"),
+        )
+        .order_by(score.desc(), ranked.c.price.asc(), ranked.c.id.asc())
+        .offset(skip)
+        .limit(limit)
+    )
+    rows = result.mappings().all()
+    if rows:
+        total = rows[0]["total"]
+    elif skip:
+        # Past the last page: the window count came with no row
+        total = await db.scalar(select(func.count()).select_from(Quote).where(Quote.rfq_id == rfq_id))
+    else:
+        total = 0
+    
+    page = RankedQuotePage(
+        rfq_id=rfq_id,
+        total=total,
+        skip=skip,
+        limit=limit,
+        items=[RankedQuote.model_validate(dict(row)) for row in rows],
+    )
+    
+    # The ETag changes whenever a quote of this RFQ (or the weights/page) changes
+    body = page.model_dump_json()
+    etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @router.patch("/{rfq_id}/status")
 async def update_rfq_status(
     rfq_id: int,
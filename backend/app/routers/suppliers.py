@@ -259,7 +259,7 @@ async def respond_to_rfq(
         
         if shop:
             product_name = rfq.product.name if rfq.product else "Sản phẩm"
-            await create_notification(
+            create_notification(
                 db=db,
                 user_id=shop.user_id,
                 notification_type="quote_received",  # <-- SỬA TỪ type= THÀNH notification_type=
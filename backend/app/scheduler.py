@@ -0,0 +1,142 @@
+"""
+Background jobs started from main.lifespan.
+
+Every job runs under a Postgres advisory lock so that only one worker
+(uvicorn process or Render instance) executes it at a time.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List
+
+from sqlalchemy import select, update, insert, func, literal, false
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config import settings
+from app.database import engine
+from app.models import RFQ, RFQStatus, Shop, Notification, NotificationType
+from app.routers.notifications import publish_notifications
+from app.idempotency import purge_expired_keys
+from app.recurring_orders import generate_recurring_orders
+from app.partitions import maintain_partitions
+
+# Advisory lock keys, one per job
+LOCK_RFQ_EXPIRY = 7_028_001
+LOCK_IDEMPOTENCY_PURGE = 7_030_001
+LOCK_RECURRING_ORDERS = 7_039_001
+LOCK_PARTITIONS = 7_048_001
+LOCK_CHAT_ROOMS_UNIQUE = 7_049_001
+LOCK_MIGRATIONS = 7_000_001
+
+Job = Callable[[AsyncConnection], Awaitable[None]]
+
+
+async def run_locked(name: str, lock_key: int, job: Job, wait: bool = False) -> bool:
+    """Run job once if this worker can take the advisory lock (with wait, once the holder releases it)"""
+    async with engine.connect() as conn:
+        if wait:
+            await conn.execute(select(func.pg_advisory_lock(lock_key)))
+            locked = True
+        else:
+            locked = await conn.scalar(select(func.pg_try_advisory_lock(lock_key)))
+        await conn.commit()
+        if not locked:
+            return False
+        try:
+            await job(conn)
+        except Exception:
+            # Never hand a connection that may still hold the lock back to the pool
+            await conn.invalidate()
+            raise
+        await conn.execute(select(func.pg_advisory_unlock(lock_key)))
+        await conn.commit()
+    return True
+
+
+async def run_periodic(name: str, interval: int, lock_key: int, job: Job):
+    while True:
+        try:
+            await run_locked(name, lock_key, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Job {name} failed: {e}")
+        await asyncio.sleep(interval)
+
+
+# ==================== JOBS ====================
+
+async def close_expired_rfqs(conn: AsyncConnection):
+    """Close PENDING/QUOTED RFQs older than RFQ_TTL_DAYS, in batches"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.RFQ_TTL_DAYS)
+    batch_size = settings.RFQ_SWEEP_BATCH_SIZE
+    
+    while True:
+        batch = (
+            select(RFQ.id)
+            .where(RFQ.status.in_([RFQStatus.PENDING, RFQStatus.QUOTED]), RFQ.created_at < cutoff)
+            .order_by(RFQ.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        result = await conn.execute(
+            update(RFQ)
+            .where(RFQ.id.in_(batch))
+            .values(status=RFQStatus.CLOSED)
+            .returning(RFQ.id)
+        )
+        closed_ids = result.scalars().all()
+        
+        notified = []
+        if closed_ids:
+            # One notification per RFQ for the owning shop, in a single INSERT ... SELECT
+            result = await conn.execute(
+                insert(Notification).from_select(
+                    ["user_id", "type", "title", "message", "link", "is_read"],
+                    select(
+                        Shop.user_id,
+                        literal(NotificationType.SYSTEM, Notification.type.type),
+                        literal("RFQ đã hết hạn"),
+                        func.concat("RFQ #", RFQ.id, " đã tự động đóng sau ", settings.RFQ_TTL_DAYS, " ngày"),
+                        literal("/shop/rfq"),
+                        false(),
+                    )
+                    .join(Shop, Shop.id == RFQ.shop_id)
+                    .where(RFQ.id.in_(closed_ids))
+                )
+                .returning(Notification.id, Notification.user_id)
+            )
+            notified = result.all()
+        await conn.commit()
+        publish_notifications(notified)
+        
+        if closed_ids:
+            print(f"🧹 Closed {len(closed_ids)} expired RFQs")
+        if len(closed_ids) < batch_size:
+            break
+
+
+def start_jobs() -> List[asyncio.Task]:
+    if not settings.SCHEDULER_ENABLED:
+        return []
+    return [
+        asyncio.create_task(run_periodic(
+            "rfq-expiry", settings.RFQ_SWEEP_INTERVAL_SECONDS, LOCK_RFQ_EXPIRY, close_expired_rfqs
+        )),
+        asyncio.create_task(run_periodic(
+            "idempotency-purge", 3600, LOCK_IDEMPOTENCY_PURGE, purge_expired_keys
+        )),
+        asyncio.create_task(run_periodic(
+            "recurring-orders", settings.RECURRING_ORDER_INTERVAL_SECONDS, LOCK_RECURRING_ORDERS,
+            generate_recurring_orders
+        )),
+        asyncio.create_task(run_periodic(
+            "partitions", settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS, LOCK_PARTITIONS,
+            maintain_partitions
+        )),
+    ]
+
+
+async def stop_jobs(tasks: List[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -2,7 +2,7 @@ from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime, date
 from decimal import Decimal
-from app.models import UserRole, ProductStatus, RFQStatus, QuoteStatus, ContractStatus, NotificationType, OrderStatus, PaymentMethod
+from app.models import UserRole, ProductStatus, RFQStatus, QuoteStatus, ContractStatus, NotificationType, OrderStatus, PaymentMethod, RecurrenceFrequency
 
 # ==================== AUTH ====================
 class Token(BaseModel):
@@ -186,6 +186,30 @@ class QuoteWithDetails(QuoteResponse):
     supplier: SupplierResponse
     rfq: RFQResponse
 
+class RankedQuote(BaseModel):
+    id: int
+    supplier_id: int
+    company_name: Optional[str] = None
+    price: Decimal
+    min_order_qty: Optional[int] = None
+    lead_time: Optional[int] = None
+    status: QuoteStatus
+    created_at: datetime
+    price_rank: int
+    lead_time_rank: int
+    min_order_qty_rank: int
+    score: float                            # 0..1, higher is better
+    list_price: Optional[Decimal] = None
+    price_delta: Optional[Decimal] = None   # quote price - product list price
+    price_delta_pct: Optional[float] = None
+
+class RankedQuotePage(BaseModel):
+    rfq_id: int
+    total: int
+    skip: int
+    limit: int
+    items: List[RankedQuote]
+
 # ==================== NEGOTIATION ====================
 class NegotiationBase(BaseModel):
     message: Optional[str] = None
@@ -266,6 +290,19 @@ class ChatMessageCreate(BaseModel):
     message: str  # <-- Đổi từ content thành message
 
 
+class ChatAttachmentResponse(BaseModel):
+    id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    url: str  # Download (supports Range requests)
+    created_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
 class ChatMessageResponse(BaseModel):
     id: int
     chat_room_id: int  # <-- Đổi từ room_id thành chat_room_id (khớp với model)
@@ -274,6 +311,7 @@ class ChatMessageResponse(BaseModel):
     is_read: bool = False
     created_at: datetime
     sender: Optional[UserResponse] = None  # Thêm sender info
+    attachments: List[ChatAttachmentResponse] = []
     
     class Config:
         from_attributes = True
@@ -289,12 +327,27 @@ class ChatRoomResponse(BaseModel):
     shop: Optional[ShopResponse] = None
     last_message: Optional[ChatMessageResponse] = None
     unread_count: Optional[int] = 0
+    partner_online: Optional[bool] = None
     messages: Optional[List[ChatMessageResponse]] = []
     
     class Config:
         from_attributes = True
 
 
+class ChatSearchResult(BaseModel):
+    message_id: int
+    chat_room_id: int
+    sender_id: int
+    snippet: str  # HTML-escaped excerpt, matches wrapped in <mark></mark>
+    rank: float
+    created_at: datetime
+
+
+class ChatSearchPage(BaseModel):
+    items: List[ChatSearchResult]
+    next_cursor: Optional[str] = None
+
+
 # ==================== ORDER ====================
 class OrderCreate(BaseModel):
     contract_id: int
@@ -304,12 +357,39 @@ class OrderCreate(BaseModel):
     payment_method: Optional[PaymentMethod] = PaymentMethod.BANK_TRANSFER
 
 
+class OrderLineCreate(BaseModel):
+    contract_id: int
+    quantity: int = Field(gt=0)
+
+
+class OrderMultiCreate(BaseModel):
+    """Several contracts with the same supplier in one order"""
+    lines: List[OrderLineCreate] = Field(min_length=1, max_length=200)
+    shipping_address: str
+    note: Optional[str] = None
+    payment_method: Optional[PaymentMethod] = PaymentMethod.BANK_TRANSFER
+
+
 class OrderUpdate(BaseModel):
     status: Optional[OrderStatus] = None
     shipping_address: Optional[str] = None
     note: Optional[str] = None
 
 
+class OrderBulkStatusUpdate(BaseModel):
+    order_ids: List[int] = Field(min_length=1, max_length=500)
+    status: OrderStatus
+    note: Optional[str] = None
+
+
+class OrderBulkStatusResult(BaseModel):
+    order_id: int
+    ok: bool
+    status: Optional[OrderStatus] = None
+    version: Optional[int] = None
+    error: Optional[str] = None
+
+
 class OrderResponse(BaseModel):
     id: int
     order_code: str
@@ -325,6 +405,7 @@ class OrderResponse(BaseModel):
     payment_method: PaymentMethod
     payment_proof: Optional[str] = None
     paid_at: Optional[datetime] = None
+    version: int = 1
     created_at: datetime
     updated_at: Optional[datetime] = None
     
@@ -332,6 +413,22 @@ class OrderResponse(BaseModel):
         from_attributes = True
 
 
+class OrderItemResponse(BaseModel):
+    id: int
+    contract_id: int
+    product_id: int
+    quantity: int
+    unit_price: Decimal
+    total_amount: Decimal
+    
+    class Config:
+        from_attributes = True
+
+
+class OrderWithItems(OrderResponse):
+    items: List[OrderItemResponse] = []
+
+
 class OrderTrackingResponse(BaseModel):
     id: int
     order_id: int
@@ -354,6 +451,87 @@ class OrderWithDetails(OrderResponse):
         from_attributes = True
 
 
+# Flat projection used by GET /orders (no ORM objects involved)
+class OrderListProduct(BaseModel):
+    id: int
+    name: str
+    image_url: Optional[str] = None
+
+
+class OrderListContract(BaseModel):
+    id: int
+    contract_code: Optional[str] = None
+    agreed_price: float = 0
+    status: Optional[ContractStatus] = None
+    product: Optional[OrderListProduct] = None
+
+
+class OrderListSupplier(BaseModel):
+    id: int
+    company_name: Optional[str] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+
+
+class OrderListShop(BaseModel):
+    id: int
+    shop_name: Optional[str] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+
+
+class OrderListItem(BaseModel):
+    id: int
+    order_code: str
+    contract_id: int
+    supplier_id: int
+    shop_id: int
+    quantity: int
+    unit_price: float = 0
+    total_amount: float = 0
+    shipping_address: Optional[str] = None
+    note: Optional[str] = None
+    status: OrderStatus = OrderStatus.PENDING
+    payment_method: PaymentMethod = PaymentMethod.BANK_TRANSFER
+    payment_proof: Optional[str] = None
+    paid_at: Optional[datetime] = None
+    version: int = 1
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    contract: Optional[OrderListContract] = None
+    supplier: Optional[OrderListSupplier] = None
+    shop: Optional[OrderListShop] = None
+
+
+# ==================== RECURRING ORDERS ====================
+class RecurringOrderScheduleCreate(BaseModel):
+    contract_id: int
+    quantity: int = Field(gt=0)
+    frequency: RecurrenceFrequency
+    start_date: Optional[date] = None  # First order date, defaults to today
+    shipping_address: str
+    note: Optional[str] = None
+    payment_method: Optional[PaymentMethod] = PaymentMethod.BANK_TRANSFER
+
+
+class RecurringOrderScheduleResponse(BaseModel):
+    id: int
+    contract_id: int
+    shop_id: int
+    quantity: int
+    frequency: RecurrenceFrequency
+    next_run_date: date
+    shipping_address: Optional[str] = None
+    note: Optional[str] = None
+    payment_method: PaymentMethod
+    is_active: bool
+    last_run_at: Optional[datetime] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
 # ==================== PAYMENT INFO ====================
 class PaymentInfoCreate(BaseModel):
     bank_name: Optional[str] = None
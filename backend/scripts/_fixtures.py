@@ -0,0 +1,75 @@
+"""
+Shared setup for the concurrency checks in this folder.
+
+Each run creates its own supplier, shop, product and contract (unique emails),
+so it can be pointed at any development database. Requests go to the app
+in-process, or to a running server with --url (which must use the same
+DATABASE_URL as the script).
+"""
+import argparse
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+from app.auth import create_access_token, get_password_hash
+from app.database import AsyncSessionLocal
+from app.models import (
+    User, Supplier, Shop, Product, Contract, UserRole, ProductStatus, ContractStatus
+)
+
+
+def parse_args(description: str, **defaults) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--requests", type=int, default=defaults.get("requests", 50), help="Parallel requests")
+    parser.add_argument("--url", help="Base URL of a running server (default: the app in-process)")
+    for name, value in defaults.items():
+        if name != "requests":
+            parser.add_argument(f"--{name}", type=type(value), default=value)
+    return parser.parse_args()
+
+
+def api_client(url: str = None) -> httpx.AsyncClient:
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=120)
+    from app.main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check", timeout=120)
+
+
+def auth_headers(user: User) -> dict:
+    token = create_access_token(data={"sub": str(user.id), "role": user.role.value})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def create_partners(stock: int = 0):
+    """Supplier and shop users with an active contract on a product holding stock units"""
+    tag = uuid.uuid4().hex[:8]
+    async with AsyncSessionLocal() as db:
+        supplier_user = User(
+            email=f"check-supplier-{tag}@example.com", password_hash=get_password_hash(tag),
+            full_name=f"Check supplier {tag}", role=UserRole.SUPPLIER, email_verified=True, is_approved=True
+        )
+        shop_user = User(
+            email=f"check-shop-{tag}@example.com", password_hash=get_password_hash(tag),
+            full_name=f"Check shop {tag}", role=UserRole.SHOP, email_verified=True, is_approved=True
+        )
+        db.add_all([supplier_user, shop_user])
+        await db.flush()
+        supplier = Supplier(user_id=supplier_user.id, company_name=f"Check supplier {tag}")
+        shop = Shop(user_id=shop_user.id, shop_name=f"Check shop {tag}")
+        db.add_all([supplier, shop])
+        await db.flush()
+        product = Product(
+            supplier_id=supplier.id, name=f"Check product {tag}", price=1000, stock=stock,
+            status=ProductStatus.ACTIVE
+        )
+        db.add(product)
+        await db.flush()
+        contract = Contract(
+            supplier_id=supplier.id, shop_id=shop.id, product_id=product.id, agreed_price=1000,
+            quantity=stock, start_date=date.today(), end_date=date.today() + timedelta(days=30),
+            status=ContractStatus.ACTIVE
+        )
+        db.add(contract)
+        await db.commit()
+        return supplier_user, shop_user, product, contract
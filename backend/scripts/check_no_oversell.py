@@ -0,0 +1,75 @@
+"""
+Concurrency check: parallel orders never take more stock than there is.
+
+Fires --requests parallel orders of one unit (alternating POST /orders and
+POST /orders/multi) at a product holding --stock units, then checks that
+exactly --stock of them succeeded, the others got 409, and the product's
+stock ended at 0. Cancelling one order gives its unit back exactly once.
+
+    cd backend && python -m scripts.check_no_oversell [--requests 50] [--stock 10] [--url http://localhost:8000]
+
+Exits with status 1 if an invariant does not hold.
+"""
+import asyncio
+import sys
+from collections import Counter
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal, engine
+from app.models import Product
+from scripts._fixtures import parse_args, api_client, auth_headers, create_partners
+
+
+async def _stock(product_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(Product.stock).where(Product.id == product_id))
+
+
+async def check(requests: int, stock: int, url: str = None) -> bool:
+    supplier_user, shop_user, product, contract = await create_partners(stock)
+    shop_headers = auth_headers(shop_user)
+
+    async with api_client(url) as client:
+        async def place(i: int):
+            if i % 2:
+                return await client.post("/orders/multi", headers=shop_headers, json={
+                    "lines": [{"contract_id": contract.id, "quantity": 1}], "shipping_address": "Check"
+                })
+            return await client.post("/orders/", headers=shop_headers, json={
+                "contract_id": contract.id, "quantity": 1, "shipping_address": "Check"
+            })
+
+        responses = await asyncio.gather(*[place(i) for i in range(requests)])
+        statuses = Counter(response.status_code for response in responses)
+        remaining = await _stock(product.id)
+        print(f"📦 {requests} orders for {stock} units: {dict(statuses)}, stock left {remaining}")
+
+        ok = statuses[200] == min(stock, requests) and statuses[409] == requests - statuses[200] and remaining == stock - statuses[200]
+
+        # Cancelling gives the unit back once, however often it is attempted
+        order_id = next(response.json()["id"] for response in responses if response.status_code == 200)
+        supplier_headers = auth_headers(supplier_user)
+        cancels = await asyncio.gather(*[
+            client.patch(f"/orders/{order_id}/status", params={"new_status": "cancelled"}, headers=supplier_headers)
+            for _ in range(5)
+        ])
+        restored = await _stock(product.id)
+        print(f"↩️ 5 parallel cancels: {sorted(r.status_code for r in cancels)}, stock {remaining} -> {restored}")
+        ok = ok and restored == remaining + 1
+
+    print("✅ No oversell" if ok else "❌ Invariant violated")
+    return ok
+
+
+async def _main():
+    args = parse_args(__doc__.strip().splitlines()[0], requests=50, stock=10)
+    try:
+        ok = await check(args.requests, args.stock, args.url)
+    finally:
+        await engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
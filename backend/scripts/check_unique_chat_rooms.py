@@ -0,0 +1,61 @@
+"""
+Concurrency check: parallel get-or-create never duplicates a chat room.
+
+Fires --requests parallel POST /chat/rooms/with/{partner} for a fresh supplier
+and shop, half from each side, then checks that every response carries the
+same room id and that exactly one chat_rooms row exists for the pair.
+
+    cd backend && python -m scripts.check_unique_chat_rooms [--requests 50] [--url http://localhost:8000]
+
+Exits with status 1 if an invariant does not hold.
+"""
+import asyncio
+import sys
+from collections import Counter
+
+from sqlalchemy import select, func
+
+from app.database import AsyncSessionLocal, engine
+from app.models import ChatRoom, Supplier, Shop
+from scripts._fixtures import parse_args, api_client, auth_headers, create_partners
+
+
+async def check(requests: int, url: str = None) -> bool:
+    supplier_user, shop_user, _, _ = await create_partners()
+    supplier_headers, shop_headers = auth_headers(supplier_user), auth_headers(shop_user)
+
+    async with api_client(url) as client:
+        responses = await asyncio.gather(*[
+            client.post(f"/chat/rooms/with/{shop_user.id}", headers=supplier_headers) if i % 2
+            else client.post(f"/chat/rooms/with/{supplier_user.id}", headers=shop_headers)
+            for i in range(requests)
+        ])
+
+    statuses = Counter(response.status_code for response in responses)
+    room_ids = {response.json()["id"] for response in responses if response.status_code == 200}
+    async with AsyncSessionLocal() as db:
+        rooms = await db.scalar(
+            select(func.count())
+            .select_from(ChatRoom)
+            .join(Supplier, Supplier.id == ChatRoom.supplier_id)
+            .join(Shop, Shop.id == ChatRoom.shop_id)
+            .where(Supplier.user_id == supplier_user.id, Shop.user_id == shop_user.id)
+        )
+    print(f"💬 {requests} parallel get-or-create: {dict(statuses)}, room ids {sorted(room_ids)}, rows {rooms}")
+
+    ok = statuses[200] == requests and len(room_ids) == 1 and rooms == 1
+    print("✅ One room per pair" if ok else "❌ Invariant violated")
+    return ok
+
+
+async def _main():
+    args = parse_args(__doc__.strip().splitlines()[0], requests=50)
+    try:
+        ok = await check(args.requests, args.url)
+    finally:
+        await engine.dispose()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())